@@ -0,0 +1,160 @@
+import copy
+import json
+import sys
+import time
+
+from notion_dbitem_to_page import Walker
+
+
+class RecursiveWalker(object):
+    """The recursive Walker that the iterative one replaced, as a baseline."""
+
+    def __init__(self, transform):
+        self.transform = transform
+        self.current_block = None
+        self.transformed_blocks = []
+
+    def replace(self, value):
+        return self.transformed_blocks.append((self.current_block, value))
+
+    def walk_list(self, source):
+        for value in source:
+            if isinstance(value, dict):
+                yield self.walk_dict(value)
+            elif isinstance(value, str):
+                yield self.transform(value, replace=self.replace)
+            else:
+                yield value
+
+    def walk_dict(self, source):
+        if source.get("object") == "block":
+            self.current_block = source
+
+        for key, value in source.items():
+            if isinstance(value, dict):
+                self.walk_dict(value)
+            elif isinstance(value, list):
+                source[key] = list(self.walk_list(value))
+            elif isinstance(value, str):
+                source[key] = self.transform(value, replace=self.replace)
+        return source
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for original, processed in self.transformed_blocks:
+            original.clear()
+            original.update(processed)
+
+
+def rich_text(text):
+    return [
+        {
+            "type": "text",
+            "text": {"content": text, "link": None},
+            "annotations": {"bold": False, "italic": False, "color": "default"},
+            "plain_text": text,
+            "href": None,
+        }
+    ]
+
+
+def block(index, block_type="paragraph", text=None, children=None):
+    body = {"rich_text": rich_text(text or f"Some text {index}"), "color": "default"}
+    if children:
+        body["children"] = children
+    return {
+        "object": "block",
+        "id": f"block-{index}",
+        "type": block_type,
+        "has_children": bool(children),
+        block_type: body,
+    }
+
+
+def table(index, rows=4):
+    # no {{tokens}} in the cells (lists of lists): the recursive walker
+    # left them as is, the iterative one renders them
+    cells = [
+        {
+            "object": "block",
+            "id": f"row-{index}-{row}",
+            "type": "table_row",
+            "table_row": {"cells": [rich_text(f"Item {row}"), rich_text("1")]},
+        }
+        for row in range(rows)
+    ]
+    return {
+        "object": "block",
+        "id": f"table-{index}",
+        "type": "table",
+        "table": {"table_width": 2, "children": cells},
+    }
+
+
+def template(size=10000):
+    """
+    A page of about `size` blocks: paragraphs, some holding {{tokens}},
+    toggles of nested blocks, tables, and blocks replaced by line_items.
+    """
+    children, index = [], 0
+    while index < size:
+        if index % 100 == 0:
+            children.append(block(index, text="{{line_items}}"))
+            index += 1
+        elif index % 50 == 0:
+            children.append(table(index))
+            index += 5
+        elif index % 10 == 0:
+            nested = [block(index + i, text="{{Name}} owes {{Total}}") for i in (1, 2)]
+            children.append(block(index, "toggle", children=nested))
+            index += 3
+        else:
+            children.append(block(index))
+            index += 1
+    return {"object": "page", "properties": {}, "children": children}
+
+
+VALUES = {"{{Name}}": "ACME", "{{Total}}": "42"}
+
+
+def transform(value, replace):
+    if value == "{{line_items}}":
+        replace(table("items"))
+        return value
+    for token, replacement in VALUES.items():
+        value = value.replace(token, replacement)
+    return value
+
+
+def run(walker_class, page):
+    with walker_class(transform) as walker:
+        walker.walk_dict(page)
+    return page
+
+
+def best_of(walker_class, source, repeat):
+    timings = []
+    for _ in range(repeat):
+        page = copy.deepcopy(source)
+        start = time.perf_counter()
+        run(walker_class, page)
+        timings.append(time.perf_counter() - start)
+    return min(timings), page
+
+
+if __name__ == "__main__":
+    # [blocks] [repeat]: time the template walkers on a generated template
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    source = template(size)
+
+    baseline, expected = best_of(RecursiveWalker, source, repeat)
+    iterative, rendered = best_of(Walker, source, repeat)
+    if json.dumps(rendered, sort_keys=True) != json.dumps(expected, sort_keys=True):
+        sys.exit("The walkers rendered different pages")
+
+    print(f"{size} blocks, best of {repeat}")
+    print(f"recursive: {baseline * 1000:.1f}ms")
+    print(f"iterative: {iterative * 1000:.1f}ms ({baseline / iterative:.2f}x)")
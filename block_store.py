@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from cache import LRUCache
+
+
+def canonical(value) -> bytes:
+    # always the standard encoder: the hashes must not depend on orjson
+    return json.dumps(
+        value, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+
+
+def _children(block):
+    return block.get(block.get("type"), {}).get("children")
+
+
+def _with_children(block, children):
+    block_type = block.get("type")
+    return dict(block, **{block_type: dict(block[block_type], children=children)})
+
+
+class BlockStore(object):
+    """
+    Content-addressed storage of blocks (next to the dumps, shared by all
+    the runs of an export): a block is stored once, under the hash of its
+    canonical JSON, with its children replaced by their hashes. A block
+    that did not change is never written again, and a block whose subtree
+    changed only costs the rewrite of the blocks on the way to the change.
+
+    Pages dumped with a store hold the hashes of their children blocks
+    (see read_dump), and each run records a snapshot: the hash of every
+    page of the export. Diffing two snapshots is comparing hashes.
+    """
+
+    FOLDER = "blocks"
+    SNAPSHOTS = "snapshots"
+    KNOWN_CACHE_SIZE = 100000
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.path = os.path.join(folder, self.FOLDER)
+        self._known = LRUCache(self.KNOWN_CACHE_SIZE)
+        self.written = 0
+
+    def _object_path(self, digest):
+        return os.path.join(self.path, digest[:2], f"{digest[2:]}.json")
+
+    def _write(self, value) -> str:
+        data = canonical(value)
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in self._known:
+            return digest
+
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fd:
+                fd.write(data)
+            os.replace(tmp_path, path)
+            self.written += 1
+        self._known[digest] = True
+        return digest
+
+    def put(self, block: Dict) -> str:
+        """Store the block and its subtree, return the hash of the block."""
+        # post-order: the children are stored (and hashed) before their parent
+        stack = [(block, False)]
+        hashes = []
+        while stack:
+            node, expanded = stack.pop()
+            children = _children(node)
+            if not children:
+                hashes.append(self._write(node))
+            elif not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+            else:
+                digests = hashes[len(hashes) - len(children) :]
+                del hashes[len(hashes) - len(children) :]
+                hashes.append(self._write(_with_children(node, digests)))
+        return hashes[0]
+
+    def put_object(self, value: Dict) -> str:
+        """Store a value as is (e.g. a page holding the hashes of its blocks)."""
+        return self._write(value)
+
+    def get_object(self, digest: str) -> Dict:
+        with open(self._object_path(digest), encoding="utf-8") as fd:
+            return json.load(fd)
+
+    def get(self, digest: str) -> Dict:
+        """The block of the given hash, with its whole subtree."""
+        root = self.get_object(digest)
+        stack = [root]
+        while stack:
+            block = stack.pop()
+            digests = _children(block)
+            if digests:
+                children = [self.get_object(child) for child in digests]
+                block[block["type"]]["children"] = children
+                stack.extend(children)
+        return root
+
+    def __contains__(self, digest) -> bool:
+        return digest in self._known or os.path.exists(self._object_path(digest))
+
+    def snapshot(self, pages: Dict[str, str], name: Optional[str] = None) -> str:
+        """Record the hashes of the pages of a run, return the snapshot path."""
+        name = name or time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        folder = os.path.join(self.folder, self.SNAPSHOTS)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{name}.json")
+        with open(f"{path}.tmp", "w") as fd:
+            json.dump({"pages": pages}, fd, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+        return path
+
+    def snapshots(self) -> List[str]:
+        folder = os.path.join(self.folder, self.SNAPSHOTS)
+        if not os.path.isdir(folder):
+            return []
+        names = os.listdir(folder)
+        return sorted(name[:-5] for name in names if name.endswith(".json"))
+
+    def load_snapshot(self, name: str) -> Dict[str, str]:
+        with open(os.path.join(self.folder, self.SNAPSHOTS, f"{name}.json")) as fd:
+            return json.load(fd)["pages"]
+
+
+def diff_snapshots(old: Dict[str, str], new: Dict[str, str]) -> Dict[str, List[str]]:
+    """The ids of the pages added, removed and changed between two snapshots."""
+    return {
+        "added": sorted(uid for uid in new if uid not in old),
+        "removed": sorted(uid for uid in old if uid not in new),
+        "changed": sorted(
+            uid for uid, digest in new.items() if uid in old and old[uid] != digest
+        ),
+    }
+
+
+def read_dump(path: str) -> Dict:
+    """
+    Read a dump of the export. The children of the pages dumped with a
+    BlockStore are hashes: they are read back from the store.
+    """
+    with open(path, encoding="utf-8") as fd:
+        data = json.load(fd)
+    if data.pop("block_store", False):
+        store = BlockStore(os.path.dirname(os.path.abspath(path)))
+        data["children"] = [store.get(digest) for digest in data.get("children", [])]
+    return data
+
+
+if __name__ == "__main__":
+    # export_folder [old_snapshot new_snapshot]: the pages changed between
+    # two snapshots (by default, the last two)
+    store = BlockStore(sys.argv[1])
+    names = sys.argv[2:4] or store.snapshots()[-2:]
+    if len(names) < 2:
+        sys.exit(f"Not enough snapshots in {store.folder}")
+    old, new = (store.load_snapshot(name) for name in names)
+    print(json.dumps(diff_snapshots(old, new), indent=2))
@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+
+class CrawlJournal(object):
+    """
+    Append-only journal of the crawl frontier (JSON lines).
+
+    Every enqueued and visited item is appended as it happens, and the file
+    is fsynced every `sync_every` events, so a killed run loses at most the
+    last batch. Replaying the journal rebuilds the buffer and the visited
+    items; compacting rewrites it with one line per known item.
+    """
+
+    FILENAME = "journal.jsonl"
+    SYNC_EVERY = 50
+
+    def __init__(self, folder: str, sync_every: int = SYNC_EVERY) -> None:
+        self.path = os.path.join(folder, self.FILENAME)
+        self.sync_every = sync_every
+        self._pending = 0
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def replay(self) -> Tuple[Dict, Dict]:
+        buffer, visited = {}, {}
+        with open(self.path, encoding="utf-8") as fd:
+            for line_number, line in enumerate(fd, 1):
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    logging.warning(
+                        f"Ignoring the truncated entry {line_number} of {self.path}"
+                    )
+                    break
+
+                item = event["item"]
+                uid = item["id"]
+                if event["op"] == "enqueue":
+                    if uid not in visited:
+                        buffer[uid] = item
+                elif event["op"] == "visit":
+                    buffer.pop(uid, None)
+                    visited[uid] = {k: v for k, v in item.items() if k != "id"}
+        return buffer, visited
+
+    def compact(self, buffer: Dict, visited: Dict):
+        self.close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fd:
+            for uid, item in visited.items():
+                fd.write(self._line("visit", {**item, "id": uid}))
+            for item in buffer.values():
+                fd.write(self._line("enqueue", item))
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _line(self, op, item):
+        return json.dumps({"op": op, "item": item}) + "\n"
+
+    def record(self, op: str, item: Dict):
+        line = self._line(op, item)
+        with self._lock:
+            if self._fd is None:
+                self._fd = open(self.path, "a", encoding="utf-8")
+            self._fd.write(line)
+            self._pending += 1
+            if self._pending >= self.sync_every:
+                self._sync()
+
+    def _sync(self):
+        if self._fd is not None and self._pending:
+            self._fd.flush()
+            os.fsync(self._fd.fileno())
+        self._pending = 0
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
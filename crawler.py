@@ -1,23 +1,41 @@
+import asyncio
+from contextvars import ContextVar
 from datetime import datetime
 import json
 import logging
 import os
-import shutil
+import threading
 from typing import Dict, List
 
+from crawl_journal import CrawlJournal
+from frontier import Frontier
+
+# the item being crawled, to derive the depth and root of the items it links to
+current_item: ContextVar[Dict] = ContextVar("current_item", default={})
+
 
 class Crawler(object):
     EXPORT_FOLDER = "notion-export"
 
     def __init__(
-        self, root_pages: List, export_folder: str = EXPORT_FOLDER, resume: bool = False
+        self,
+        root_pages: List,
+        export_folder: str = EXPORT_FOLDER,
+        resume: bool = False,
+        frontier: Dict = None,
     ) -> None:
+        """
+        `frontier` holds the Frontier options (policy, max_depth, root_quota).
+        """
         self.export_folder = export_folder
-        self._resume_buffer_and_visited(root_pages, resume)
-
+        self.frontier_options = frontier or {}
         if not os.path.isdir(self.export_folder):
             os.makedirs(self.export_folder)
 
+        self.journal = CrawlJournal(self.export_folder)
+        self._buffer_lock = threading.Lock()
+        self._resume_buffer_and_visited(root_pages, resume)
+
     def compute_buffer(self):
         raise NotImplementedError("Please Implement this method")
 
@@ -41,7 +59,10 @@ class Crawler(object):
         self.buffer = {}
         self.visited = {}
 
-        if resume:
+        if resume and self.journal.exists():
+            self.buffer, self.visited = self.journal.replay()
+        elif resume:
+            # exports started before the journal was introduced
             try:
                 with open(self._buffer_file_path()) as fd:
                     self.buffer = json.load(fd)
@@ -56,39 +77,46 @@ class Crawler(object):
         if not self.buffer:
             self.buffer = buffer
 
-        if isinstance(self.buffer, list):
-            self.buffer = {item["id"]: item for item in self.buffer}
+        items = self.buffer if isinstance(self.buffer, list) else self.buffer.values()
+        self.buffer = Frontier(**self.frontier_options, items=items)
 
         if not self.visited:
             self.visited = {}
 
-    def _persist_buffer_and_history(self):
-        if self.buffer:
-            path = self._buffer_file_path()
-
-            if os.path.exists(path):
-                shutil.copyfile(path, f"{path}.backup")
-
-            with open(path, "w") as fd:
-                json.dump(self.buffer, fd)
+        self.journal.compact(self.buffer, self.visited)
 
-        path = self._visited_file_path()
-        with open(path, "w") as fd:
-            json.dump(self.visited, fd)
+    def _persist_buffer_and_history(self):
+        self.journal.sync()
 
     def append_to_buffer(
         self, type: str, uid: str, title: str = None, parent: str = None
     ):
         if uid in self.visited:
             return
-        self.buffer[uid] = {"type": type, "id": uid, "title": title, "parent": parent}
+        crawling = current_item.get()
+        item = {
+            "type": type,
+            "id": uid,
+            "title": title,
+            "parent": parent or crawling.get("id"),
+            "depth": crawling.get("depth", -1) + 1,
+            "root": crawling.get("root", uid),
+        }
+        with self._buffer_lock:
+            pushed = self.buffer.push(item)
+        if pushed:
+            self.journal.record("enqueue", item)
+
+    def _mark_visited(self, uid, item):
+        self.visited[uid] = item
+        self.journal.record("visit", {**item, "id": uid})
 
     def append_to_visited(
         self, type: str, uid: str, title: str = None, parent: str = None
     ):
         if uid in self.visited:
             raise Exception(f"Visiting twice {uid}")
-        self.visited[uid] = {"type": type, "id": uid, "title": title, "parent": parent}
+        self._mark_visited(uid, {"type": type, "title": title, "parent": parent})
 
     def crawl(self):
         items = self.buffer
@@ -105,14 +133,73 @@ class Crawler(object):
                 logging.info(
                     f"{now} ({len(self.visited)}✅ {len(self.buffer)}▶️) crawl {kind} {uid}"
                 )
+                token = current_item.set({"id": uid, **item})
                 try:
                     getattr(self, f"crawl_{kind}")(uid, **item)
-                    self.visited[uid] = item
+                    self._mark_visited(uid, item)
                 except:
                     logging.exception("Unexpected exception caught: persisting buffer and visited.")
                     self._persist_buffer_and_history()
                     raise
+                finally:
+                    current_item.reset(token)
 
             item = self.buffer.popitem() if self.buffer else None
 
+        self.journal.sync()
+        self.tear_down()
+
+    async def crawl_async(self, concurrency: int = 8):
+        """
+        Same as crawl, but keeps up to `concurrency` items in flight.
+        Items are dispatched to the `acrawl_<type>` coroutines.
+        """
+        in_flight = {}
+
+        async def visit(kind, uid, item):
+            current_item.set({"id": uid, **item})
+            await getattr(self, f"acrawl_{kind}")(uid, **item)
+            self._mark_visited(uid, item)
+
+        while self.buffer or in_flight:
+            while self.buffer and len(in_flight) < concurrency:
+                _, item = self.buffer.popitem()
+                kind = item.pop("type")
+                uid = item.pop("id")
+                crawling = {entry["id"] for entry in in_flight.values()}
+                if uid in self.visited or uid in crawling:
+                    continue
+
+                now = datetime.utcnow().isoformat()
+                logging.info(
+                    f"{now} ({len(self.visited)}✅ {len(self.buffer)}▶️) crawl {kind} {uid}"
+                )
+                task = asyncio.ensure_future(visit(kind, uid, dict(item)))
+                in_flight[task] = {"type": kind, "id": uid, **item}
+
+            if not in_flight:
+                # all the items left were visited, or being crawled, already
+                continue
+
+            done, _ = await asyncio.wait(
+                in_flight.keys(), return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                entry = in_flight.pop(task)
+                if task.exception() is None:
+                    continue
+
+                logging.error(
+                    "Unexpected exception caught: persisting buffer and visited.",
+                    exc_info=task.exception(),
+                )
+                for pending in in_flight:
+                    pending.cancel()
+                await asyncio.gather(*in_flight, return_exceptions=True)
+                for unfinished in [entry, *in_flight.values()]:
+                    self.buffer[unfinished["id"]] = unfinished
+                self._persist_buffer_and_history()
+                raise task.exception()
+
+        self.journal.sync()
         self.tear_down()
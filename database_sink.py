@@ -0,0 +1,229 @@
+import itertools
+import os
+import uuid
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from dump_writer import encode
+from property_values import evaluate_items
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, for the parquet sink
+    pyarrow = None
+
+# the columns of the properties whose values are not strings
+COLUMN_TYPES = {"number": "double", "checkbox": "bool"}
+# formulas and rollups: by the type of their result
+RESULT_TYPES = {"number": "double", "boolean": "bool"}
+META_COLUMNS = [("_id", "id"), ("_last_edited_time", "last_edited_time")]
+
+
+def database_schema(database: Dict) -> List[Tuple[str, str]]:
+    """The (column name, Notion property type) of the rows of a database."""
+    properties = database.get("properties", {})
+    return [(name, prop.get("type")) for name, prop in properties.items()]
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def _typed(value, column_type):
+    if value is None or value == "":
+        return None
+    if column_type == "double":
+        is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        return float(value) if is_number else None
+    if column_type == "bool":
+        return value if isinstance(value, bool) else None
+    return value if isinstance(value, str) else str(value)
+
+
+class RowSink(object):
+    """
+    Writes the items of a database as rows of typed columns: one column per
+    property, holding the values of the property evaluators, plus the id and
+    last_edited_time of the items. Rows are buffered, then written
+    `chunk_size` at a time.
+    """
+
+    EXTENSION = None
+
+    def __init__(self, path: str, schema: List[Tuple[str, str]], chunk_size=10000):
+        self.path = f"{path}.{self.EXTENSION}"
+        self.schema = schema
+        self.chunk_size = chunk_size
+        self.types = None
+        self.count = 0
+        self._pending = []
+
+    def _column_type(self, name, kind, items):
+        if kind in ("formula", "rollup"):
+            for item in items:
+                prop = item.get("properties", {}).get(name)
+                if prop and prop.get(kind):
+                    return RESULT_TYPES.get(prop[kind].get("type"), "string")
+            return "string"
+        return COLUMN_TYPES.get(kind, "string")
+
+    def _resolve_types(self, items):
+        self.types = [(name, "string") for name, _ in META_COLUMNS]
+        self.types.extend(
+            (name, self._column_type(name, kind, items)) for name, kind in self.schema
+        )
+
+    def _columns(self, items) -> Dict[str, List]:
+        values = evaluate_items(items, [name for name, _ in self.schema])
+        columns = {
+            name: [item.get(key) for item in items] for name, key in META_COLUMNS
+        }
+        for name, column_type in self.types[len(META_COLUMNS) :]:
+            columns[name] = [_typed(value, column_type) for value in values[name]]
+        return columns
+
+    def write(self, items: List[Dict]):
+        if self.types is None:
+            self._resolve_types(items)
+        self._pending.extend(items)
+        while len(self._pending) >= self.chunk_size:
+            self._flush(self._pending[: self.chunk_size])
+            del self._pending[: self.chunk_size]
+
+    def _flush(self, items):
+        self._write_columns(self._columns(items), len(items))
+        self.count += len(items)
+
+    def _write_columns(self, columns, count):
+        raise NotImplementedError("Please Implement this method")
+
+    def _commit(self):
+        raise NotImplementedError("Please Implement this method")
+
+    def _abort(self):
+        raise NotImplementedError("Please Implement this method")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._abort()
+            return
+        if self.types is None:
+            self._resolve_types([])
+        if self._pending or not self.count:
+            self._flush(self._pending)
+            self._pending = []
+        self._commit()
+
+
+class NdjsonSink(RowSink):
+    """
+    A folder of NDJSON files of up to `chunk_size` rows, listed with the
+    column types in its index.json. The files of an export have names of
+    their own, and its index replaces the previous one only once they are
+    all written: until then, the previous export stays complete.
+    """
+
+    EXTENSION = "ndjson"
+    INDEX = "index.json"
+
+    def __init__(self, path, schema, chunk_size=10000, compact=False):
+        super().__init__(path, schema, chunk_size)
+        self.compact = compact
+        self.chunks = []
+        self.generation = uuid.uuid4().hex[:12]
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def _write_columns(self, columns, count):
+        if not count:
+            return
+        name = f"part-{self.generation}-{len(self.chunks):05d}.ndjson"
+        names = list(columns)
+        path = os.path.join(self.path, name)
+        with open(f"{path}.tmp", "wb") as fd:
+            for row in zip(*columns.values()):
+                fd.write(encode(dict(zip(names, row)), self.compact) + b"\n")
+        os.replace(f"{path}.tmp", path)
+        self.chunks.append(
+            {
+                "path": name,
+                "rows": count,
+                "first_id": columns["_id"][0],
+                "last_id": columns["_id"][-1],
+            }
+        )
+
+    def _commit(self):
+        index = {
+            "format": "ndjson",
+            "columns": [{"name": name, "type": kind} for name, kind in self.types],
+            "rows": self.count,
+            "chunks": self.chunks,
+        }
+        index_path = os.path.join(self.path, self.INDEX)
+        with open(f"{index_path}.tmp", "wb") as fd:
+            fd.write(encode(index))
+        os.replace(f"{index_path}.tmp", index_path)
+
+        # the files of the previous exports
+        current = {chunk["path"] for chunk in self.chunks}
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and name not in current:
+                os.remove(os.path.join(self.path, name))
+
+    def _abort(self):
+        for chunk in self.chunks:
+            os.remove(os.path.join(self.path, chunk["path"]))
+
+
+class ParquetSink(RowSink):
+    """A Parquet file, a row group per `chunk_size` rows; requires pyarrow."""
+
+    EXTENSION = "parquet"
+    ARROW_TYPES = {"double": "float64", "bool": "bool_", "string": "string"}
+
+    def __init__(self, path, schema, chunk_size=10000, compact=False):
+        if pyarrow is None:
+            raise ImportError("The parquet sink requires `pip install pyarrow`")
+        super().__init__(path, schema, chunk_size)
+        self.tmp_path = f"{self.path}.tmp"
+        self._writer = None
+
+    def _arrow_schema(self):
+        return pyarrow.schema(
+            [
+                (name, getattr(pyarrow, self.ARROW_TYPES[kind])())
+                for name, kind in self.types
+            ]
+        )
+
+    def _write_columns(self, columns, count):
+        schema = self._arrow_schema()
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(self.tmp_path, schema)
+        self._writer.write_table(pyarrow.table(columns, schema=schema))
+
+    def _commit(self):
+        self._writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def _abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            os.remove(self.tmp_path)
+
+
+SINKS = {"ndjson": NdjsonSink, "parquet": ParquetSink}
+
+
+def open_sink(kind: str, path: str, schema: List[Tuple[str, str]], **kwargs) -> RowSink:
+    if kind not in SINKS:
+        raise ValueError(f"Unknown database sink {kind}, use one of {tuple(SINKS)}")
+    return SINKS[kind](path, schema, **kwargs)
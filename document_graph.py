@@ -0,0 +1,131 @@
+import copy
+import logging
+import os
+from typing import Dict, FrozenSet, Mapping
+
+from block_store import read_dump
+from cache import LRUCache
+
+# parsed dumps, shared by all the graphs of the process
+DOCUMENTS = LRUCache(maxsize=512)
+
+
+class LazyDocument(dict):
+    """
+    A dump of the export, read from disk the first time it is accessed.
+    It is a dict so that jsonpath sees it as one.
+
+    Until then, its dict storage only holds a placeholder: not being empty,
+    it makes the code reading the storage directly (the json encoder, dict
+    copies...) go through the methods below, which all load the document
+    first. copy and deepcopy return plain dicts.
+    """
+
+    def __init__(self, path: str, graph: "DocumentGraph", ancestors: FrozenSet[str]):
+        super().__init__()
+        dict.__setitem__(self, _UNLOADED, None)
+        self._path = path
+        self._graph = graph
+        self._ancestors = ancestors
+        self._loaded = False
+
+    def _load(self):
+        if not self._loaded:
+            self._loaded = True
+            dict.clear(self)
+            dict.update(self, self._graph.load(self._path, self._ancestors))
+        return self
+
+    __hash__ = None
+
+    def __repr__(self):
+        if not self._loaded:
+            return f"LazyDocument({self._path!r})"
+        return dict.__repr__(self)
+
+    def copy(self):
+        return dict(self.items())
+
+    def __reduce_ex__(self, protocol):
+        return dict, (self.copy(),)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.copy(), memo)
+
+
+# the key of the dict storage of a LazyDocument not loaded yet
+_UNLOADED = object()
+
+
+def _loading(name):
+    method = getattr(dict, name)
+
+    def loading(self, *args, **kwargs):
+        return method(self._load(), *args, **kwargs)
+
+    loading.__name__ = name
+    return loading
+
+
+for _name in (
+    "__getitem__",
+    "__setitem__",
+    "__delitem__",
+    "__contains__",
+    "__iter__",
+    "__reversed__",
+    "__len__",
+    "__eq__",
+    "__ne__",
+    "__or__",
+    "get",
+    "keys",
+    "values",
+    "items",
+    "pop",
+    "popitem",
+    "setdefault",
+    "update",
+    "clear",
+):
+    setattr(LazyDocument, _name, _loading(_name))
+
+
+class DocumentGraph(object):
+    """
+    The dumps of an export, linked together: the child databases of a page
+    and the items of a database are LazyDocuments, so only the documents
+    actually looked at are read. Parsed documents are cached across calls,
+    and references back to a document being read (cycles) are left as ids.
+    """
+
+    def __init__(self, db: Mapping[str, str], cache: LRUCache = DOCUMENTS) -> None:
+        self.db = db
+        self.cache = cache
+
+    def load(self, path: str, ancestors: FrozenSet[str] = frozenset()) -> Dict:
+        path = os.path.abspath(path)
+        key = (path, os.path.getmtime(path))
+        data = self.cache.get(key)
+        if data is None:
+            data = read_dump(path)
+            self._link(data, ancestors | {path})
+            self.cache.set(key, data)
+        return data
+
+    def _reference(self, uid, ancestors):
+        path = os.path.abspath(self.db[uid])
+        if path in ancestors:
+            logging.warning(f"Not following {uid}: it refers back to {path}")
+            return uid
+        return LazyDocument(path, self, ancestors)
+
+    def _link(self, data, ancestors):
+        for child in data.get("children", []):
+            if child.get("type") == "child_database":
+                child["database"] = self._reference(child["id"], ancestors)
+
+        if data.get("items"):
+            data["items"] = [
+                self._reference(item, ancestors) for item in data.get("items", [])
+            ]
@@ -0,0 +1,66 @@
+import json
+import os
+from typing import Dict
+
+try:
+    import orjson
+except ImportError:  # optional, faster encoder
+    orjson = None
+
+
+def encode(value, compact=False) -> bytes:
+    if compact and orjson is not None:
+        return orjson.dumps(value)
+    if compact:
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+    return json.dumps(value).encode("utf-8")
+
+
+class StreamingJsonWriter(object):
+    """
+    Writes `header` as a JSON object whose `list_key` entry is a list
+    streamed item by item with `append`, so that the items do not need
+    to be held in memory. The file is written to a temporary path, then
+    atomically renamed to `path` when the context exits without error.
+    """
+
+    def __init__(
+        self, path: str, header: Dict, list_key: str = "children", compact=False
+    ) -> None:
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.header = header
+        self.list_key = list_key
+        self.compact = compact
+        self._fd = None
+        self._count = 0
+
+    def __enter__(self):
+        self._fd = open(self.tmp_path, "wb")
+        sep = b"," if self.compact else b", "
+        colon = b":" if self.compact else b": "
+        self._fd.write(b"{")
+        for key, value in self.header.items():
+            if key == self.list_key:
+                continue
+            self._fd.write(encode(key) + colon + encode(value, self.compact) + sep)
+        self._fd.write(encode(self.list_key) + colon + b"[")
+        return self
+
+    def append(self, item):
+        if self._count:
+            self._fd.write(b"," if self.compact else b", ")
+        self._fd.write(encode(item, self.compact))
+        self._count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._fd.write(b"]}")
+        finally:
+            self._fd.close()
+
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
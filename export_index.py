@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from notion_client import format_id
+
+
+class ExportIndex(object):
+    """
+    Manifest of an export (SQLite, next to the dumps): for each exported
+    object, its dump path, type, title, parent and last_edited_time, plus
+    free-form extra values (the pages/databases it links to, database
+    watermarks...). Kept up to date by NotionExportCrawler.dump.
+
+    Also a mapping from object id to dump path, as used by
+    read_data_recursively.
+
+    Updates are committed in batches (of `COMMIT_EVERY` updates, or every
+    `COMMIT_INTERVAL` seconds) and by save: call it before reading the index
+    from another connection.
+    """
+
+    FILENAME = "index.sqlite"
+    LEGACY_FILENAME = "index.json"
+    COLUMNS = ("path", "type", "title", "parent", "last_edited_time")
+    COMMIT_EVERY = 100
+    COMMIT_INTERVAL = 5
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.path = os.path.join(folder, self.FILENAME)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._committed_at = time.monotonic()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS objects (
+                id TEXT PRIMARY KEY,
+                path TEXT,
+                type TEXT,
+                title TEXT,
+                parent TEXT,
+                last_edited_time TEXT,
+                extra TEXT NOT NULL DEFAULT '{}'
+            )
+            """
+        )
+        self._db.commit()
+        self._import_legacy_index()
+
+    @classmethod
+    def exists(cls, folder: str) -> bool:
+        return os.path.exists(os.path.join(folder, cls.FILENAME))
+
+    def _import_legacy_index(self):
+        legacy_path = os.path.join(self.folder, self.LEGACY_FILENAME)
+        if not os.path.exists(legacy_path):
+            return
+
+        try:
+            with open(legacy_path) as fd:
+                entries = json.load(fd)
+        except ValueError:
+            logging.exception(f"Unable to import {legacy_path}.")
+            return
+
+        for uid, entry in entries.items():
+            self.update(uid, **entry)
+        os.replace(legacy_path, f"{legacy_path}.imported")
+
+    def _row_to_entry(self, row):
+        entry = json.loads(row[-1])
+        entry.update(
+            {name: value for name, value in zip(self.COLUMNS, row[:-1]) if value}
+        )
+        return entry
+
+    def get(self, uid) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(self.COLUMNS)}, extra FROM objects WHERE id = ?",
+                (format_id(uid),),
+            ).fetchone()
+        return self._row_to_entry(row) if row else None
+
+    def update(self, uid, **values):
+        """Set the given values of the entry, in a single upsert."""
+        columns = [name for name in self.COLUMNS if name in values]
+        extra = {key: value for key, value in values.items() if key not in columns}
+        names = ", ".join(["id", *columns, "extra"])
+        placeholders = ", ".join("?" for _ in range(len(columns) + 2))
+        # extra values are merged into the extra values of the entry
+        assignments = ", ".join(
+            [f"{name} = excluded.{name}" for name in columns]
+            + ["extra = json_patch(extra, excluded.extra)"]
+        )
+        row = (format_id(uid), *(values[name] for name in columns), json.dumps(extra))
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO objects ({names}) VALUES ({placeholders}) "
+                f"ON CONFLICT (id) DO UPDATE SET {assignments}",
+                row,
+            )
+            self._pending += 1
+            if (
+                self._pending >= self.COMMIT_EVERY
+                or time.monotonic() - self._committed_at > self.COMMIT_INTERVAL
+            ):
+                self._commit()
+
+    def _commit(self):
+        self._db.commit()
+        self._pending = 0
+        self._committed_at = time.monotonic()
+
+    def merge(self, other: "ExportIndex", **values):
+        """Copy all the entries of another index, with the given extra values."""
+        rows = []
+        for uid, entry in other.entries():
+            entry.update(values)
+            columns = [entry.pop(name, None) for name in self.COLUMNS]
+            rows.append((uid, *columns, json.dumps(entry)))
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+
+    def is_unchanged(self, uid, last_edited_time) -> bool:
+        entry = self.get(uid)
+        return bool(
+            entry
+            and last_edited_time
+            and entry.get("last_edited_time") == last_edited_time
+            and os.path.exists(self._resolve(entry))
+        )
+
+    def _resolve(self, entry):
+        # the dumps live next to the index (in the folder of their shard, for
+        # sharded exports), wherever it was crawled from
+        path = os.path.basename(entry.get("path") or "")
+        return os.path.join(self.folder, entry.get("shard", ""), path)
+
+    def entries(self) -> Iterator[Tuple[str, Dict]]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, {', '.join(self.COLUMNS)}, extra FROM objects"
+            ).fetchall()
+        for row in rows:
+            yield row[0], self._row_to_entry(row[1:])
+
+    def __getitem__(self, uid) -> str:
+        entry = self.get(uid)
+        if not entry or not entry.get("path"):
+            raise KeyError(uid)
+        return self._resolve(entry)
+
+    def __contains__(self, uid) -> bool:
+        return bool((self.get(uid) or {}).get("path"))
+
+    def save(self):
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._db.close()
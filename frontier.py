@@ -0,0 +1,111 @@
+import heapq
+import itertools
+import logging
+from collections import Counter
+from typing import Callable, Dict, Iterable, Optional
+
+
+def default_priority(item):
+    """Pages before databases, then the shallowest items first."""
+    return (item.get("type") == "database", item.get("depth", 0))
+
+
+class Frontier(object):
+    """
+    The items waiting to be crawled, ordered by a policy:
+
+    - lifo: last enqueued first (the historical dict.popitem order)
+    - fifo: first enqueued first
+    - bfs: shallowest first
+    - dfs: deepest first
+    - priority: lowest `priority(item)` first
+
+    Items deeper than `max_depth`, or enqueued once `root_quota` items
+    were already enqueued for the same root, are dropped.
+    Exposes the subset of the dict interface the crawler relies on.
+    """
+
+    POLICIES = ("lifo", "fifo", "bfs", "dfs", "priority")
+
+    def __init__(
+        self,
+        policy: str = "lifo",
+        max_depth: Optional[int] = None,
+        root_quota: Optional[int] = None,
+        priority: Callable[[Dict], object] = default_priority,
+        items: Iterable[Dict] = (),
+    ) -> None:
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown frontier policy {policy}, use one of {self.POLICIES}")
+        self.policy = policy
+        self.max_depth = max_depth
+        self.root_quota = root_quota
+        self.priority = priority
+        self.items: Dict[str, Dict] = {}
+        self.root_counts = Counter()
+        self._heap = []
+        self._counter = itertools.count()
+
+        for item in items:
+            self.push(item)
+
+    def _key(self, item, seq):
+        depth = item.get("depth", 0)
+        if self.policy == "lifo":
+            return (-seq,)
+        if self.policy == "fifo":
+            return (seq,)
+        if self.policy == "bfs":
+            return (depth, seq)
+        if self.policy == "dfs":
+            return (-depth, -seq)
+        return (self.priority(item), seq)
+
+    def push(self, item: Dict) -> bool:
+        uid = item["id"]
+        item.setdefault("depth", 0)
+        item.setdefault("root", uid)
+
+        if uid in self.items:
+            self.items[uid] = item
+            return True
+
+        if self.max_depth is not None and item["depth"] > self.max_depth:
+            logging.debug(f"Skipping {uid}: deeper than {self.max_depth}")
+            return False
+
+        root = item["root"]
+        if self.root_quota is not None and self.root_counts[root] >= self.root_quota:
+            logging.debug(f"Skipping {uid}: quota of {root} reached")
+            return False
+
+        self.root_counts[root] += 1
+        self.items[uid] = item
+        seq = next(self._counter)
+        heapq.heappush(self._heap, (self._key(item, seq), seq, uid))
+        return True
+
+    def popitem(self):
+        while self._heap:
+            _, _, uid = heapq.heappop(self._heap)
+            if uid in self.items:
+                return uid, self.items.pop(uid)
+        raise KeyError("popitem(): frontier is empty")
+
+    def __setitem__(self, uid, item):
+        self.push({**item, "id": uid})
+
+    def __getitem__(self, uid):
+        return self.items[uid]
+
+    def __contains__(self, uid):
+        return uid in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def values(self):
+        return self.items.values()
@@ -1,168 +1,140 @@
-import copy
-
-TABLE_TEMPLATE = {
-    "object": "block",
-    "has_children": True,
-    "archived": False,
-    "type": "table",
-    "table": {
-        "table_width": 5,
-        "has_column_header": True,
-        "has_row_header": False,
-        "children": [
-            {
-                "object": "block",
-                "has_children": False,
-                "archived": False,
-                "type": "table_row",
-                "table_row": {
-                    "cells": [
-                        [
-                            {
-                                "type": "text",
-                                "text": {"content": "Name", "link": None},
-                                "annotations": {
-                                    "bold": False,
-                                    "italic": False,
-                                    "strikethrough": False,
-                                    "underline": False,
-                                    "code": False,
-                                    "color": "default",
-                                },
-                                "plain_text": "Name",
-                                "href": None,
-                            }
-                        ],
-                        [
-                            {
-                                "type": "text",
-                                "text": {"content": "Description", "link": None},
-                                "annotations": {
-                                    "bold": False,
-                                    "italic": False,
-                                    "strikethrough": False,
-                                    "underline": False,
-                                    "code": False,
-                                    "color": "default",
-                                },
-                                "plain_text": "Description",
-                                "href": None,
-                            }
-                        ],
-                        [
-                            {
-                                "type": "text",
-                                "text": {"content": "Unit Price", "link": None},
-                                "annotations": {
-                                    "bold": False,
-                                    "italic": False,
-                                    "strikethrough": False,
-                                    "underline": False,
-                                    "code": False,
-                                    "color": "default",
-                                },
-                                "plain_text": "Unit Price",
-                                "href": None,
-                            }
-                        ],
-                        [
-                            {
-                                "type": "text",
-                                "text": {"content": "Quantity", "link": None},
-                                "annotations": {
-                                    "bold": False,
-                                    "italic": False,
-                                    "strikethrough": False,
-                                    "underline": False,
-                                    "code": False,
-                                    "color": "default",
-                                },
-                                "plain_text": "Quantity",
-                                "href": None,
-                            }
-                        ],
-                        [
-                            {
-                                "type": "text",
-                                "text": {"content": "Total", "link": None},
-                                "annotations": {
-                                    "bold": False,
-                                    "italic": False,
-                                    "strikethrough": False,
-                                    "underline": False,
-                                    "code": False,
-                                    "color": "default",
-                                },
-                                "plain_text": "Total",
-                                "href": None,
-                            }
-                        ],
-                    ]
-                },
+from property_values import evaluate_items
+
+
+class Column(object):
+    """
+    A column of a table built from database items: the item property it
+    shows, its header (the property name by default), and optionally the
+    aggregate ("sum" or "count") shown for it in a last row.
+    """
+
+    def __init__(self, name, header=None, aggregate=None) -> None:
+        if aggregate is not None and aggregate not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {aggregate}")
+        self.name = name
+        self.header = header or name
+        self.aggregate = aggregate
+
+
+def _sum(values):
+    total = sum(
+        value
+        for value in values
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    )
+    return round(total, 10) if isinstance(total, float) else total
+
+
+def _count(values):
+    return sum(1 for value in values if value not in ("", None))
+
+
+AGGREGATES = {"sum": _sum, "count": _count}
+
+DEFAULT_COLUMNS = [
+    Column("Name"),
+    Column("Description"),
+    Column("Price", "Unit Price"),
+    Column("Quantity"),
+    Column("Total"),
+]
+ORDER = [column.name for column in DEFAULT_COLUMNS]
+
+
+def _cell(value):
+    value = str(value)
+    return [
+        {
+            "type": "text",
+            "text": {"content": value, "link": None},
+            "annotations": {
+                "bold": False,
+                "italic": False,
+                "strikethrough": False,
+                "underline": False,
+                "code": False,
+                "color": "default",
             },
-        ],
-    },
-}
-
-CELL_TEMPLATE = {
-    "type": "text",
-    "text": {"content": "FIXME", "link": None},
-    "annotations": {
-        "bold": False,
-        "italic": False,
-        "strikethrough": False,
-        "underline": False,
-        "code": False,
-        "color": "default",
-    },
-    "plain_text": "FIXME",
-    "href": None,
-}
-
-ROW_TEMPLATE = {
-    "object": "block",
-    "has_children": False,
-    "archived": False,
-    "type": "table_row",
-    "table_row": {"cells": []},
-}
-
-ORDER = ["Name", "Description", "Price", "Quantity", "Total"]
-
-
-def _eval_prop(prop, eval_property_value):
-    value = eval_property_value(prop["type"], prop[prop["type"]])
-    return value
-
-
-def _build_prop_map(match, eval_property_value=None):
+            "plain_text": value,
+            "href": None,
+        }
+    ]
+
+
+def _row(values):
     return {
-        name: eval_property_value(prop["type"], prop[prop["type"]])
-        for name, prop in match.value["properties"].items()
+        "object": "block",
+        "has_children": False,
+        "archived": False,
+        "type": "table_row",
+        "table_row": {"cells": [_cell(value) for value in values]},
     }
 
 
-def _prepare_cell(value):
-    cell = copy.deepcopy(CELL_TEMPLATE)
-    cell["text"]["content"] = str(value)
-    cell["plain_text"] = str(value)
-    return cell
+def _aggregate_row(columns, values, label):
+    row = []
+    for index, column in enumerate(columns):
+        if column.aggregate:
+            row.append(AGGREGATES[column.aggregate](values[index]))
+        else:
+            row.append(label if index == 0 else "")
+    return row
 
 
-def _prepare_row(match, eval_property_value):
-    row = copy.deepcopy(ROW_TEMPLATE)
-    prop_map = _build_prop_map(match, eval_property_value)
-    for column in ORDER:
-        cell = _prepare_cell(prop_map.get(column, ""))
-        row["table_row"]["cells"].append([cell])
-    return row
+def table(matches, columns, eval_property_value=None, aggregate_label="Total"):
+    """
+    A table block with a header row, then a row per matched item: the
+    values are evaluated one column at a time, only for the properties
+    shown. When a column has an aggregate, a last row holds them.
+    """
+    columns = [
+        column if isinstance(column, Column) else Column(column) for column in columns
+    ]
+    evaluated = evaluate_items(
+        [match.value for match in matches],
+        [column.name for column in columns],
+        eval_property_value,
+    )
+    values = [evaluated[column.name] for column in columns]
+
+    rows = [_row([column.header for column in columns])]
+    rows.extend(_row(row) for row in zip(*values))
+    if any(column.aggregate for column in columns):
+        rows.append(_row(_aggregate_row(columns, values, aggregate_label)))
 
+    return {
+        "object": "block",
+        "has_children": True,
+        "archived": False,
+        "type": "table",
+        "table": {
+            "table_width": len(columns),
+            "has_column_header": True,
+            "has_row_header": False,
+            "children": rows,
+        },
+    }
 
-def line_items(matches, eval_property_value=None):
-    table = copy.deepcopy(TABLE_TEMPLATE)
 
-    for match in matches:
-        row = _prepare_row(match, eval_property_value)
-        table["table"]["children"].append(row)
+def table_builder(columns, aggregate_label="Total"):
+    """Return a template function building a table with the given columns."""
+
+    def build(matches, eval_property_value=None):
+        return table(matches, columns, eval_property_value, aggregate_label)
+
+    return build
 
-    return table
+
+def line_items(matches, eval_property_value=None):
+    return table(matches, DEFAULT_COLUMNS, eval_property_value)
+
+
+line_items_with_total = table_builder(
+    [
+        Column("Name"),
+        Column("Description"),
+        Column("Price", "Unit Price"),
+        Column("Quantity", aggregate="sum"),
+        Column("Total", aggregate="sum"),
+    ]
+)
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+from collections import Counter
+
+import httpx
+
+from notion_client import NotionApiClient, format_id
+from rate_limiter import TokenBucket
+
+
+class AsyncNotionApiClient(NotionApiClient):
+    """
+    asyncio flavour of NotionApiClient: every API method returns an awaitable,
+    and the paginate_* methods are async generators.
+    Requires `pip install httpx` (`httpx[http2]` for http2=True).
+    """
+
+    def __init__(
+        self,
+        token,
+        rate=3,
+        burst=5,
+        max_retries=5,
+        max_in_flight=8,
+        http2=False,
+        session=None,
+        rate_limiter=None,
+        cache=None,
+    ) -> None:
+        self.token = token
+        self.headers = self.default_headers()
+        self.rate_limiter = rate_limiter or TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self.cache = self._make_cache(cache)
+        self.transport_errors = (httpx.TransportError,)
+        self.unsent_errors = (httpx.ConnectError, httpx.ConnectTimeout)
+        if session is None:
+            limits = httpx.Limits(
+                max_connections=max_in_flight, max_keepalive_connections=max_in_flight
+            )
+            session = httpx.AsyncClient(http2=http2, limits=limits)
+        self.session = session
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def close(self):
+        await self.session.aclose()
+
+    async def _call_api(self, path, method="POST", payload_dict=None):
+        cached = self._cached(method, path)
+        if cached is not None:
+            return cached
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            async with self._in_flight:
+                if await self.rate_limiter.acquire_async() > 0:
+                    self._count("delayed")
+                self._count("calls")
+
+                retry_after, status = None, None
+                try:
+                    response = await self.session.request(
+                        method,
+                        f"{self.BASE_URL}/{path}",
+                        headers=self.headers,
+                        json=payload_dict,
+                        timeout=30,
+                    )
+                except self.transport_errors as exc:
+                    error = exc
+                else:
+                    payload, error, retry_after = self._handle_response(
+                        response, method, path
+                    )
+                    if error is None:
+                        return self._store(method, path, payload)
+                    status = response.status_code
+
+            if attempt == self.max_retries or not self._may_retry(
+                method, path, error, status
+            ):
+                break
+            await asyncio.sleep(self._retry_delay(attempt, error, retry_after))
+
+        raise self._give_up(method, path, payload_dict, error, attempt + 1) from error
+
+    async def paginate_search(self, query=None, object_type=None):
+        async for item in self._paginate(
+            None, self.search, query=query, object_type=object_type
+        ):
+            yield item
+
+    async def list_databases_ids(self):
+        async for db in self.list_databases():
+            if db.get("object") == "database":
+                yield db.get("id")
+
+    async def list_database_properties(self, database_id):
+        response = await self.get_database(database_id)
+        for name, value in response.get("properties").items():
+            kind = value.get("type")
+            info = value.get(kind)
+            yield (name, kind, info)
+
+    async def _paginate(self, object_id, fun, **kwargs):
+        has_more, start_cursor = True, None
+        args = () if object_id is None else (format_id(object_id),)
+        while has_more:
+            response = await fun(*args, start_cursor=start_cursor, **kwargs)
+            for block in response.get("results", []):
+                yield block
+            has_more = response.get("has_more", False)
+            start_cursor = response.get("next_cursor", None)
+
+    async def paginate_children_blocks(self, page_id):
+        async for item in self._paginate(page_id, self.retrieve_children_blocks):
+            yield item
+
+    async def paginate_children_items(
+        self, page_id, filter=None, sort_order=None, filter_properties=None
+    ):
+        async for item in self._paginate(
+            page_id,
+            self.list_database_items,
+            filter=filter,
+            sort_order=sort_order,
+            filter_properties=filter_properties,
+        ):
+            yield item
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+import sys
+from typing import Dict, List
+
+from notion_async_client import AsyncNotionApiClient
+from notion_exporter import NotionExportCrawler
+
+
+class AsyncNotionExportCrawler(NotionExportCrawler):
+    """
+    NotionExportCrawler running on asyncio: `concurrency` pages or databases
+    are crawled at the same time, and all their block trees are fetched
+    concurrently, under the rate limiter shared with the synchronous client.
+    """
+
+    CONCURRENCY = 8
+    # the client_options applying to the asyncio client as well; rate and
+    # burst apply through the rate limiter it shares with the other client
+    ASYNC_CLIENT_OPTIONS = ("max_retries", "http2")
+
+    def __init__(self, token, concurrency: int = CONCURRENCY, **kwargs) -> None:
+        super().__init__(token, **kwargs)
+        self.concurrency = concurrency
+        client_options = kwargs.get("client_options") or {}
+        self.async_client = AsyncNotionApiClient(
+            token,
+            max_in_flight=self.max_workers,
+            rate_limiter=self.client.rate_limiter,
+            cache=self.client.cache,
+            **{
+                key: value
+                for key, value in client_options.items()
+                if key in self.ASYNC_CLIENT_OPTIONS
+            },
+        )
+
+    async def aprocess_single_block(self, block_id) -> List[Dict]:
+        blocks = [
+            block
+            async for block in self.async_client.paginate_children_blocks(block_id)
+        ]
+        for block in blocks:
+            self.extract_next_page_to_visit(block)
+
+        parents = [block for block in blocks if self._needs_children(block)]
+        children = await asyncio.gather(
+            *[self.aprocess_single_block(parent.get("id")) for parent in parents]
+        )
+        for parent, parent_children in zip(parents, children):
+            parent[parent.get("type")]["children"] = parent_children
+
+        return blocks
+
+    async def acrawl_page(self, page_id, title=None, **kwargs):
+        page = await self.async_client.get_page(page_id)
+        if page.get("archived"):
+            logging.warning(f"The page {page.get('url')} is archived. Skipping.")
+            return
+
+        if self._page_unchanged(page_id, page):
+            return self.index.get(page_id)["path"]
+
+        blocks = await self.aprocess_single_block(page_id)
+        self._project_properties(page)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.resolve_properties, page
+        )
+
+        return self._dump_page(page_id, title, page, blocks)
+
+    async def acrawl_database(self, database_id, title=None, **kwargs):
+        database = await self.async_client.get_database(database_id)
+        known, query = self._database_query(database_id, database)
+        items = [
+            item
+            async for item in self.async_client.paginate_children_items(
+                database_id, **query
+            )
+        ]
+        loop = asyncio.get_running_loop()
+        if self._database_rule(database_id).get("sink"):
+            return await loop.run_in_executor(
+                None, self._dump_database_rows, database_id, title, database, items
+            )
+
+        members = None
+        if known.get("watermark"):
+            members = [
+                item["id"]
+                async for item in self.async_client.paginate_children_items(
+                    database_id, **self._members_query(database_id, query)
+                )
+            ]
+        await loop.run_in_executor(None, self.resolve_relations, items)
+        return self._dump_database(
+            database_id, title, database, items, known, members
+        )
+
+    async def export(self):
+        if self.discover:
+            self.discover_workspace()
+        try:
+            await self.crawl_async(self.concurrency)
+        finally:
+            await self.async_client.close()
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+
+    job_desc_file = sys.argv[-1]
+    with open(job_desc_file) as fp:
+        job_desc = json.load(fp)
+
+    crawler = AsyncNotionExportCrawler(**job_desc)
+    asyncio.run(crawler.export())
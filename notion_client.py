@@ -1,10 +1,23 @@
 import logging
-from datetime import datetime, timedelta
+import threading
+from collections import Counter
 from time import sleep
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from rate_limiter import TokenBucket, backoff_delay, parse_retry_after
+from response_cache import ResponseCache
 
 VERSION = "2022-02-22"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# the answers telling the request was not processed: safe to send it again
+NOT_PROCESSED_STATUSES = (429, 503)
+
+
+class NotionApiError(Exception):
+    pass
 
 
 def logged(prefix):
@@ -37,13 +50,69 @@ def format_id(item_id):
     return "".join(output)
 
 
+def pooled_session(pool_size=10):
+    """A keep-alive requests session with up to `pool_size` connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def http2_session(pool_size=10):
+    """An HTTP/2 transport; requires `pip install httpx[http2]`."""
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=pool_size, max_keepalive_connections=pool_size
+    )
+    return httpx.Client(http2=True, limits=limits)
+
+
 class NotionApiClient(object):
     BASE_URL = "https://api.notion.com/v1"
 
-    def __init__(self, token) -> None:
+    def __init__(
+        self,
+        token,
+        rate=3,
+        burst=5,
+        max_retries=5,
+        pool_size=10,
+        http2=False,
+        session=None,
+        transport_errors=(requests.RequestException,),
+        unsent_errors=(requests.ConnectTimeout, NewConnectionError),
+        rate_limiter=None,
+        cache=None,
+    ) -> None:
+        """
+        `session` may be any object exposing `request(method, url, headers=,
+        json=, timeout=)` (a requests.Session, an httpx.Client...), in which
+        case `transport_errors` lists the exceptions worth retrying, and
+        `unsent_errors` those raised before the request was sent (the only
+        ones worth retrying when creating or updating objects).
+        `rate_limiter` allows several clients to share the same rate budget.
+        `cache` enables the on-disk cache of GET responses: a ResponseCache,
+        the path of its database, or a dict of ResponseCache options.
+        """
         super().__init__()
         self.token = token
-        self.last_call = datetime.now()
+        self.headers = self.default_headers()
+        self.transport_errors = tuple(transport_errors)
+        self.unsent_errors = tuple(unsent_errors)
+        if session is None and http2:
+            import httpx
+
+            session = http2_session(pool_size)
+            self.transport_errors += (httpx.TransportError,)
+            self.unsent_errors += (httpx.ConnectError, httpx.ConnectTimeout)
+        self.session = session if session is not None else pooled_session(pool_size)
+        self.rate_limiter = rate_limiter or TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self.cache = self._make_cache(cache)
 
     def default_headers(self):
         return {
@@ -53,36 +122,156 @@ class NotionApiClient(object):
             "Accept": "application/json",
         }
 
+    @staticmethod
+    def _make_cache(cache):
+        if isinstance(cache, str):
+            return ResponseCache(cache)
+        if isinstance(cache, dict):
+            return ResponseCache(**cache)
+        return cache
+
+    def _cached(self, method, path):
+        if self.cache is None:
+            return None
+        if method != "GET":
+            self.cache.invalidate(path)
+            return None
+        payload = self.cache.get(method, path)
+        if payload is not None:
+            self._count("cached")
+        return payload
+
+    def _store(self, method, path, payload):
+        if self.cache is not None and method == "GET":
+            if payload.get("object") != "error":
+                self.cache.set(method, path, payload)
+        return payload
+
+    def close(self):
+        self.session.close()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _handle_response(self, response, method, path):
+        """
+        Return (payload, error, retry_after).
+        payload is None when the call is worth retrying.
+        """
+        if response.status_code not in RETRY_STATUSES:
+            self.rate_limiter.recover()
+            try:
+                return response.json(), None, None
+            except ValueError as exc:
+                raise NotionApiError(
+                    f"Invalid response {response.status_code} while {method}ing {path}"
+                ) from exc
+
+        error = NotionApiError(f"HTTP {response.status_code} while {method}ing {path}")
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if response.status_code == 429:
+            self._count("throttled")
+            self.rate_limiter.throttle(retry_after)
+        return None, error, retry_after
+
+    @staticmethod
+    def _idempotent(method, path):
+        """Whether sending the call again cannot create or update anything twice."""
+        if method == "GET":
+            return True
+        # the reads POSTed to the API
+        path = path.split("?")[0]
+        return method == "POST" and (path == "search" or path.endswith("/query"))
+
+    def _unsent(self, error):
+        if isinstance(error, self.unsent_errors):
+            return True
+        # requests wraps the errors of urllib3, e.g. a refused connection
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, self.unsent_errors)
+
+    def _may_retry(self, method, path, error, status):
+        """
+        The calls creating or updating objects (pages, appended blocks...)
+        are only sent again when Notion did not receive or process them:
+        after a timeout or a 5xx, they may have been applied already.
+        """
+        if self._idempotent(method, path):
+            return True
+        if status is not None:
+            return status in NOT_PROCESSED_STATUSES
+        return self._unsent(error)
+
+    def _retry_delay(self, attempt, error, retry_after):
+        delay = max(retry_after or 0, backoff_delay(attempt))
+        self._count("retried")
+        logging.warning(f"{error}: retrying in {delay:.2f}s")
+        return delay
+
+    def _give_up(self, method, path, payload_dict, error, attempts):
+        self._count("failed")
+        return NotionApiError(
+            f"Giving up {method}ing {path} with {payload_dict} after {attempts} attempts: {error}"
+        )
+
     @logged("wrapper")
     def _call_api(self, path, method="POST", payload_dict=None):
-        delta = timedelta(seconds=0.33)
-        how_long = self.last_call + delta - datetime.now()
-        if how_long.microseconds > 0:
-            sleep(how_long.microseconds / 1000000)
-
-        try:
-            return requests.request(
-                method,
-                f"{self.BASE_URL}/{path}",
-                headers=self.default_headers(),
-                json=payload_dict,
-                timeout=30,
-            ).json()
-        except:
-            logging.exception(
-                f"Unexpected exception caught while {method}ing {path} with {payload_dict}"
-            )
-            return {}
-        finally:
-            self.last_call = datetime.now()
+        cached = self._cached(method, path)
+        if cached is not None:
+            return cached
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter.acquire() > 0:
+                self._count("delayed")
+            self._count("calls")
+
+            retry_after, status = None, None
+            try:
+                response = self.session.request(
+                    method,
+                    f"{self.BASE_URL}/{path}",
+                    headers=self.headers,
+                    json=payload_dict,
+                    timeout=30,
+                )
+            except self.transport_errors as exc:
+                error = exc
+            else:
+                payload, error, retry_after = self._handle_response(
+                    response, method, path
+                )
+                if error is None:
+                    return self._store(method, path, payload)
+                status = response.status_code
+
+            if attempt == self.max_retries or not self._may_retry(
+                method, path, error, status
+            ):
+                break
+            sleep(self._retry_delay(attempt, error, retry_after))
+
+        raise self._give_up(method, path, payload_dict, error, attempt + 1) from error
 
     def list_database_items(
-        self, database_id, filter=None, sort_order=None, start_cursor=None
+        self,
+        database_id,
+        filter=None,
+        sort_order=None,
+        start_cursor=None,
+        filter_properties=None,
     ):
+        """`filter_properties` lists the ids of the only properties to return."""
         data = self.prepare_list_database_items_payload(
             filter, sort_order, start_cursor
         )
-        return self._call_api(f"databases/{database_id}/query", payload_dict=data)
+        url = f"databases/{database_id}/query"
+        if filter_properties:
+            url += "?" + "&".join(
+                f"filter_properties={property_id}" for property_id in filter_properties
+            )
+        return self._call_api(url, payload_dict=data)
 
     def get_database(self, database_id):
         return self._call_api(f"databases/{database_id}", method="GET")
@@ -91,11 +280,39 @@ class NotionApiClient(object):
         data = {"properties": {property_name: value}}
         return self._call_api(f"pages/{page_id}", method="PATCH", payload_dict=data)
 
+    def search(self, query=None, object_type=None, start_cursor=None, page_size=100):
+        """Pages and databases shared with the integration, last edited first."""
+        return self._call_api(
+            "search",
+            payload_dict=self.prepare_search_payload(
+                query, object_type, start_cursor, page_size
+            ),
+        )
+
+    def prepare_search_payload(self, query, object_type, start_cursor, page_size):
+        result = {
+            "sort": {"direction": "descending", "timestamp": "last_edited_time"},
+            "page_size": page_size,
+        }
+        if query:
+            result["query"] = query
+        if object_type:
+            result["filter"] = {"property": "object", "value": object_type}
+        if start_cursor:
+            result["start_cursor"] = start_cursor
+        return result
+
+    def paginate_search(self, query=None, object_type=None):
+        for item in self._paginate(
+            None, self.search, query=query, object_type=object_type
+        ):
+            yield item
+
     def list_databases(self):
-        return self._call_api("databases", method="GET")
+        return self.paginate_search(object_type="database")
 
     def list_databases_ids(self):
-        for db in self.list_databases().get("results", []):
+        for db in self.list_databases():
             if db.get("object") == "database":
                 yield db.get("id")
 
@@ -134,22 +351,44 @@ class NotionApiClient(object):
             url += f"&start_cursor={start_cursor}"
         return self._call_api(url, method="GET")
 
-    def _paginate(self, object_id, fun):
+    def append_block_children(self, block_id, children):
+        data = {"children": children}
+        return self._call_api(
+            f"blocks/{block_id}/children", method="PATCH", payload_dict=data
+        )
+
+    def _paginate_pages(self, object_id, fun, **kwargs):
         has_more, start_cursor = True, None
+        args = () if object_id is None else (format_id(object_id),)
         while has_more:
-            response = fun(format_id(object_id), start_cursor=start_cursor)
-            blocks = response.get("results", [])
-            for block in blocks:
-                yield block
+            response = fun(*args, start_cursor=start_cursor, **kwargs)
+            yield response.get("results", [])
             has_more = response.get("has_more", False)
             start_cursor = response.get("next_cursor", None)
 
+    def _paginate(self, object_id, fun, **kwargs):
+        for blocks in self._paginate_pages(object_id, fun, **kwargs):
+            for block in blocks:
+                yield block
+
     def paginate_children_blocks(self, page_id):
         for item in self._paginate(page_id, self.retrieve_children_blocks):
             yield item
 
-    def paginate_children_items(self, page_id):
-        for item in self._paginate(page_id, self.list_database_items):
+    def paginate_children_block_pages(self, page_id):
+        """Same as paginate_children_blocks, one page of results at a time."""
+        return self._paginate_pages(page_id, self.retrieve_children_blocks)
+
+    def paginate_children_items(
+        self, page_id, filter=None, sort_order=None, filter_properties=None
+    ):
+        for item in self._paginate(
+            page_id,
+            self.list_database_items,
+            filter=filter,
+            sort_order=sort_order,
+            filter_properties=filter_properties,
+        ):
             yield item
 
     def get_property_value(self, page_id, property_id):
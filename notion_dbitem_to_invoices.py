@@ -1,25 +1,24 @@
-import json
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+from notion_client import pooled_session
 from notion_dbitem_to_page import discover_notion_docs, read_data_recursively
 from notion_exporter import NotionExportCrawler
+from property_values import evaluate_items
+from property_values import property_value as get_value
 
-
-def get_value(property):
-    property_type = property["type"]
-    property_value = property[property_type]
-    if isinstance(property_value, dict) and "type" in property_value:
-        return property_value[property_value["type"]]
-    elif property_type == "select":
-        return property_value["name"]
-    elif property_type == "text":
-        return property_value["content"]
-    elif isinstance(property_value, list):
-        return " ".join([get_value(p) for p in property_value])
-    else:
-        return property_value
+RENDERER_URL = "https://invoice-dragon.vercel.app/api/json"
+TIMEOUT = 60
+CHUNK_SIZE = 64 * 1024
+INVOICE_DEFAULTS = {
+    "email": "hello@nilleb.com",
+    "businessName": "nillebco",
+    "formName": "Invoice",
+    "logo": "https://avatars.githubusercontent.com/u/108630435?s=400&u=8599aa94ae4bf40efd10bae56c0542e1a9009814&v=4",
+}
 
 
 def convert_notion_to_json(data):
@@ -27,11 +26,8 @@ def convert_notion_to_json(data):
 
     for child in data["children"]:
         if child["type"] == "child_database":
-            for item in child["database"]["items"]:
-                current = {}
-                for pname, pvalue in item["properties"].items():
-                    current[pname] = get_value(pvalue)
-                items.append(current)
+            values = evaluate_items(child["database"]["items"])
+            items.extend(dict(zip(values, row)) for row in zip(*values.values()))
 
     return items
 
@@ -55,48 +51,92 @@ def convert_json_to_invoice_dragon(items):
 
 
 def generate_pdf(
-    invoice_dragon_items, template="template2", output_fn="output2.pdf", **kwargs
+    invoice_dragon_items,
+    template="template2",
+    output_fn="output2.pdf",
+    session=None,
+    url=RENDERER_URL,
+    timeout=TIMEOUT,
+    **kwargs,
 ):
-    url = "https://invoice-dragon.vercel.app/api/json"
-    data = {
-        "template": template,
-        "email": "hello@nilleb.com",
-        "businessName": "nillebco",
-        "formName": "Invoice",
-        "rows": invoice_dragon_items,
-        "logo": "https://avatars.githubusercontent.com/u/108630435?s=400&u=8599aa94ae4bf40efd10bae56c0542e1a9009814&v=4",
-    }
+    """
+    Render the invoice with the given template, and stream the PDF to
+    output_fn. `url` may point to any service accepting the invoice-dragon
+    payload, e.g. a local stand-in.
+    """
+    data = dict(INVOICE_DEFAULTS, template=template, rows=invoice_dragon_items)
     data.update(kwargs)
-    response = requests.post(url, json=data)
-    if response.status_code != 200:
+    session = session or requests
+    with session.post(url, json=data, timeout=timeout, stream=True) as response:
         response.raise_for_status()
 
-    ## save response body to pdf file
-    with open(output_fn, "wb") as f:
-        f.write(response.content)
-
-
-with open("private/api_key.txt") as f:
-    token = f.read().strip()
-
-database_item_id = sys.argv[1]
-
-crawler = NotionExportCrawler(token, export_folder="dumps", root_pages=[])
-data_path = crawler.crawl_page(database_item_id)
-
-db = discover_notion_docs(data_path)
-data = read_data_recursively(data_path, db)
-
-items = convert_notion_to_json(data)
-invoice_dragon_items = convert_json_to_invoice_dragon(items)
-
-notes = get_value(data["properties"]["Notes"])
-
-for idx in range(4):
-    print(f"Generating invoice {idx + 1}...")
-    generate_pdf(
-        invoice_dragon_items,
-        template=f"template{idx + 1}",
-        output_fn=f"output{idx + 1}.pdf",
-        notes=notes,
-    )
+        tmp_fn = f"{output_fn}.tmp"
+        try:
+            with open(tmp_fn, "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+        except BaseException:
+            # do not leave a partial PDF behind
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+            raise
+    os.replace(tmp_fn, output_fn)
+    return output_fn
+
+
+def render_invoices(
+    items,
+    templates,
+    output_fn="output{index}.pdf",
+    session=None,
+    max_workers=4,
+    **kwargs,
+):
+    """
+    Render the invoice rows `items` with each of the templates, concurrently
+    over a pooled session. `output_fn` is formatted with the template and
+    its index (from 1); other arguments are passed to generate_pdf.
+    Return the paths of the PDFs, in the order of the templates.
+    """
+    session = session or pooled_session(max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                generate_pdf,
+                items,
+                template=template,
+                output_fn=output_fn.format(index=index, template=template),
+                session=session,
+                **kwargs,
+            )
+            for index, template in enumerate(templates, 1)
+        ]
+        return [future.result() for future in futures]
+
+
+def main():
+    with open("private/api_key.txt") as f:
+        token = f.read().strip()
+
+    database_item_id = sys.argv[1]
+
+    crawler = NotionExportCrawler(token, export_folder="dumps", root_pages=[])
+    data_path = crawler.crawl_page(database_item_id)
+    crawler.index.save()
+
+    db = discover_notion_docs(data_path)
+    data = read_data_recursively(data_path, db)
+
+    items = convert_notion_to_json(data)
+    invoice_dragon_items = convert_json_to_invoice_dragon(items)
+
+    notes = get_value(data["properties"]["Notes"])
+
+    templates = [f"template{idx + 1}" for idx in range(4)]
+    print(f"Generating {len(templates)} invoices...")
+    for output_fn in render_invoices(invoice_dragon_items, templates, notes=notes):
+        print(output_fn)
+
+
+if __name__ == "__main__":
+    main()
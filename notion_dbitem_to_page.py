@@ -1,36 +1,68 @@
+import copy
 import json
 import logging
 import os
+import re
 import sys
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 
 from jsonpath_ng.ext import parse
 
 import functions
+from block_store import read_dump
+from cache import LRUCache
+from document_graph import DocumentGraph
+from export_index import ExportIndex
 from notion_client import NotionApiClient, format_id
 from notion_exporter import NotionExportCrawler, document_title
+from page_writer import PageWriter
+from property_values import evaluate as eval_value
+
+
+def _attempt(fun, *args):
+    """Return (result, None), or (None, exception) when fun raises."""
+    try:
+        return fun(*args), None
+    except Exception as exc:
+        logging.exception(f"Unexpected exception caught calling {fun.__name__}")
+        return None, exc
 
 
 class NotionTemplateApplier(NotionExportCrawler):
+    REPORT_FILENAME = "batch_report.json"
+
     def __init__(
         self,
         token,
         template_id,
         destination_parent_id,
-        database_item_id,
+        database_item_id=None,
+        database_id=None,
+        filter=None,
+        database_item_ids=None,
         **kwargs,
     ) -> None:
+        """
+        Either a single `database_item_id`, or for batches a list of
+        `database_item_ids` or a `database_id` (and optionally a `filter`
+        on its items).
+        """
         super().__init__(token, **kwargs, export_folder="dumps", root_pages=[])
         self.database_item_id = database_item_id
+        self.database_id = database_id
+        self.filter = filter
+        self.database_item_ids = database_item_ids
         self.destination_parent_id = destination_parent_id
         self.template_id = template_id
+        self.writer = PageWriter(self.client, max_workers=self.max_workers)
 
     def apply(self):
         data_path = self.crawl_page(self.database_item_id)
         template_path = self.crawl_page(self.template_id)
         self.crawl()
-        data = json.load(open(data_path))
+        data = read_dump(data_path)
         title = document_title(data)
         page = fill_template_with_data(
             template_path, data_path, self.destination_parent_id, title
@@ -39,9 +71,75 @@ class NotionTemplateApplier(NotionExportCrawler):
         with open(self.export_folder + "/future_page.json", "w") as fd:
             json.dump(page, fd)
 
-        response = self.client.create_page(page)
+        response = self.writer.create_page(page)
         print(response.get("url"))
 
+    def _item_ids(self):
+        if self.database_item_ids:
+            return list(dict.fromkeys(self.database_item_ids))
+
+        query = {"filter": self.filter} if self.filter else None
+        items = self.client.paginate_children_items(self.database_id, query)
+        return [item["id"] for item in items]
+
+    def _crawl_item(self, item_id):
+        path = self.crawl_page(item_id)
+        if not path:
+            raise ValueError(f"The item {item_id} is archived.")
+        return path
+
+    def _render(self, compiled, data_path, db):
+        data = read_data_recursively(data_path, db)
+        return compiled.render(data, self.destination_parent_id, document_title(data))
+
+    def _create_page(self, page):
+        return self.writer.create_page(page).get("url")
+
+    def apply_batch(self):
+        """
+        Create one page per database item: the template is crawled and
+        compiled once, the items are crawled concurrently, and the pages
+        are created concurrently (within the client rate limit).
+        Returns (and saves next to the dumps) a report of the created pages
+        and of the failures.
+        """
+        template_path = self.crawl_page(self.template_id)
+        item_ids = self._item_ids()
+        report = {"created": [], "failed": []}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            crawled = list(
+                executor.map(lambda uid: _attempt(self._crawl_item, uid), item_ids)
+            )
+            # the databases linked from the items, e.g. their line items
+            self.crawl()
+
+            compiled = compile_template(read_dump(template_path))
+            db = discover_notion_docs(template_path)
+
+            pages = {}
+            for item_id, (data_path, error) in zip(item_ids, crawled):
+                if error is None:
+                    pages[item_id], error = _attempt(
+                        self._render, compiled, data_path, db
+                    )
+                if error is not None:
+                    report["failed"].append({"item": item_id, "error": str(error)})
+
+            created = executor.map(
+                lambda page: _attempt(self._create_page, page), pages.values()
+            )
+            for item_id, (url, error) in zip(pages, created):
+                if error is None:
+                    report["created"].append({"item": item_id, "url": url})
+                else:
+                    report["failed"].append({"item": item_id, "error": str(error)})
+
+        with open(f"{self.export_folder}/{self.REPORT_FILENAME}", "w") as fd:
+            json.dump(report, fd, indent=2)
+
+        return report
+
 
 def remove_useless_properties_for_create(node):
     for prop in (
@@ -64,109 +162,72 @@ def remove_useless_properties_for_create(node):
         remove_useless_properties_for_create(child)
 
 
-def date_property_value(value):
-    computed = (
-        "{start}->{end}".format(**value)
-        if value.get("end")
-        else "{start}".format(**value)
-    )
-
-    tz = value.get("time_zone")
-    if tz:
-        computed = f"{computed} ({tz})"
-
-    return computed
-
-
-def text_property_value(value):
-    return "{plain_text}".format(**next(iter(value), {"plain_text": ""}))
-
-
-def identity(value):
-    return value
-
-
-def array_property_value(value):
-    return ", ".join(
-        [eval_value(val["type"], val[val["type"]]) for val in value["array"]]
-    )
-
-
-def rollup_property_value(value):
-    return eval_value(value["type"], value)
-
-
-def simple_property_value(value):
-    return value[value["type"]]
-
-
-def relation_property_value(value):
-    if value:
-        return simple_property_value(value[0])
-
-
-def select_property_value(value):
-    return value["name"]
-
-
-def eval_value(prop_type, value):
-    functions = {
-        "date": date_property_value,
-        "number": identity,
-        "title": text_property_value,
-        "rich_text": text_property_value,
-        "rollup": rollup_property_value,
-        "array": array_property_value,
-        "relation": relation_property_value,
-        "formula": simple_property_value,
-        "select": select_property_value,
-    }
-    func = functions.get(prop_type, repr)
-    try:
-        new_value = func(value)
-    except (KeyError, TypeError):
-        logging.exception(
-            f"Unexpected exception evaluating '{value}' of type '{prop_type}'"
-        )
-        new_value = value
-    return new_value
-
-
 class Walker(object):
+    """
+    Applies transform(value, replace) to the strings of a JSON document that
+    contain "{{", iteratively. transform returns the new string; calling
+    replace(block or list of blocks) replaces the block holding the string,
+    once the whole document has been walked.
+    """
+
     def __init__(self, transform):
         self.transform = transform
         self.current_block = None
         self.transformed_blocks = []
 
     def replace(self, value):
+        if self.current_block is None:
+            raise ValueError("Only blocks can be replaced")
         return self.transformed_blocks.append((self.current_block, value))
 
-    def walk_list(self, source):
-        for value in source:
-            if isinstance(value, dict):
-                yield self.walk_dict(value)
-            elif isinstance(value, str):
-                result = self.transform(value, replace=self.replace)
-                yield result
+    def walk_dict(self, source):
+        # (node, its enclosing block, the container and key of node)
+        stack = [(source, None, None, None)]
+        pop, push = stack.pop, stack.append
+        while stack:
+            node, block, container, location = pop()
+            if type(node) is dict:
+                if node.get("object") == "block":
+                    block = (node, container, location)
+                entries = node.items()
             else:
-                yield value
+                entries = enumerate(node)
+
+            for key, value in entries:
+                kind = type(value)
+                if kind is str:
+                    if "{{" in value:
+                        self.current_block = block
+                        result = self.transform(value, replace=self.replace)
+                        if result is not value:
+                            node[key] = result
+                elif kind is dict or kind is list:
+                    push((value, block, node, key))
+
+        self.replace_blocks()
+        return source
 
-    def walk_dict(self, source):
-        if source.get("object") == "block":
-            self.current_block = source
-
-        for key, value in source.items():
-            if isinstance(value, dict):
-                self.walk_dict(value)
-            elif isinstance(value, list):
-                source[key] = list(self.walk_list(value))
-            elif isinstance(value, str):
-                result = self.transform(value, replace=self.replace)
-                source[key] = result
+    def replace_blocks(self):
+        """Apply the replacements, rewriting each list concerned once."""
+        replaced = {}
+        for (block, container, key), processed in self.transformed_blocks:
+            if isinstance(processed, dict):
+                processed = [processed]
+            if isinstance(container, list):
+                replaced.setdefault(id(container), (container, {}))[1][key] = processed
+            elif len(processed) == 1:
+                self.update_block(block, processed[0])
             else:
-                source[key] = value
+                raise ValueError(
+                    f"Unable to replace the block {block.get('id')} with several blocks"
+                )
+        self.transformed_blocks = []
 
-        return source
+        for container, blocks in replaced.values():
+            rewritten = []
+            for index, value in enumerate(container):
+                rewritten.extend(blocks.get(index, (value,)))
+            container[:] = rewritten
 
     def update_block(self, original, processed):
         original.clear()
@@ -176,12 +237,19 @@ class Walker(object):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        for original, processed in self.transformed_blocks:
-            self.update_block(original, processed)
+        if exc_type is None:
+            self.replace_blocks()
 
 
 def discover_notion_docs(data_path):
+    """
+    Map the ids of the objects exported next to data_path to their dump.
+    Uses the export index when there is one, else scans the folder.
+    """
     folder = os.path.dirname(os.path.abspath(data_path))
+    if ExportIndex.exists(folder):
+        return ExportIndex(folder)
+
     files = glob(f"{folder}/*.json")
 
     db = {}
@@ -195,98 +263,147 @@ def discover_notion_docs(data_path):
 
 
 def read_data_recursively(data_path, db):
-    with open(data_path, encoding="utf-8") as fd:
-        data = json.load(fd)
-
-    for child in data.get("children", []):
-        if child.get("type") == "child_database":
-            filename = db[child["id"]]
-            child["database"] = read_data_recursively(filename, db)
-
-    if data.get("items"):
-        items = []
-        for item in data.get("items", []):
-            filename = db[item]
-            items.append(read_data_recursively(filename, db))
-        data["items"] = items
-
-    return data
+    """
+    Read the dump at data_path, with its child databases and their items.
+    These are loaded lazily, when the template looks at them.
+    """
+    return DocumentGraph(db).load(data_path)
 
 
 def fill_template_with_data(template_path, data_path, parent_id, title):
-    with open(template_path, encoding="utf-8") as fd:
-        template = json.load(fd)
+    template = read_dump(template_path)
 
     db = discover_notion_docs(data_path)
     data = read_data_recursively(data_path, db)
-    json.dump(data, open("dumps/data.json", "w"), indent=2)
 
     return _fill_template_with_data(template, data, parent_id, title)
 
 
-def _fill_template_with_data(template, data, parent_id, title):
-    remove_useless_properties_for_create(template)
-
-    template["parent"] = {"type": "page_id", "page_id": format_id(parent_id)}
-
-    template["properties"] = {
-        "title": {
-            "id": "title",
-            "type": "title",
-            "title": [
-                {
-                    "type": "text",
-                    "text": {"content": title, "link": None},
-                    "annotations": {
-                        "bold": False,
-                        "italic": False,
-                        "strikethrough": False,
-                        "underline": False,
-                        "code": False,
-                        "color": "default",
-                    },
-                    "plain_text": "Generated Page",
-                    "href": None,
-                }
-            ],
+def _normalize(value):
+    return unicodedata.normalize("NFC", value).replace("’", "'")
+
+
+class TemplateString(object):
+    """
+    A string of the template containing {{tokens}}, split once into literal
+    parts and token names, with its {{function('jsonpath')}} call (if any)
+    resolved and its JSONPath expression parsed.
+    """
+
+    TOKEN = re.compile(r"\{\{(.*?)\}\}")
+
+    def __init__(self, value):
+        uval = _normalize(value)
+        self.call = None
+        if "(" in uval and ")" in uval:
+            fun_name = uval.split("(")[0].split("{{")[1]
+            fun = getattr(functions, fun_name, None)
+            if fun:
+                expr = uval.split("('")[1].split(")'")[0]
+                self.call = (fun, parse(expr))
+        self.parts = self.TOKEN.split(uval)
+
+    def render(self, props, data, replace):
+        if self.call:
+            fun, jsonpath_expression = self.call
+            matches = [match for match in jsonpath_expression.find(data)]
+            replace(fun(matches, eval_property_value=eval_value))
+
+        rendered = []
+        for idx, part in enumerate(self.parts):
+            if idx % 2:
+                rendered.append(props.get(part, f"{{{{{part}}}}}"))
+            else:
+                rendered.append(part)
+        return "".join(rendered)
+
+
+class CompiledTemplate(object):
+    """
+    A template page ready to be rendered many times: the properties useless
+    for create_page are removed and every string with {{tokens}} is compiled
+    once, so that rendering only costs the substitutions.
+    """
+
+    def __init__(self, template):
+        self.template = copy.deepcopy(template)
+        remove_useless_properties_for_create(self.template)
+        self.strings = {}
+
+        def compile_string(val, replace):
+            if "{{" in val and "}}" in val and val not in self.strings:
+                self.strings[val] = TemplateString(val)
+            return val
+
+        Walker(compile_string).walk_dict(self.template)
+
+    def render(self, data, parent_id, title):
+        template = copy.deepcopy(self.template)
+
+        template["parent"] = {"type": "page_id", "page_id": format_id(parent_id)}
+
+        template["properties"] = {
+            "title": {
+                "id": "title",
+                "type": "title",
+                "title": [
+                    {
+                        "type": "text",
+                        "text": {"content": title, "link": None},
+                        "annotations": {
+                            "bold": False,
+                            "italic": False,
+                            "strikethrough": False,
+                            "underline": False,
+                            "code": False,
+                            "color": "default",
+                        },
+                        "plain_text": "Generated Page",
+                        "href": None,
+                    }
+                ],
+            }
         }
-    }
 
-    props = {}
-    for name, prop in data.get("properties", {}).items():
-        prop_type = prop.get("type")
-        value = prop.get(prop_type)
-        new_value = eval_value(prop_type, value)
-        token = f"{{{{{name}}}}}"
-        props[token] = str(new_value)
+        props = {}
+        for name, prop in data.get("properties", {}).items():
+            prop_type = prop.get("type")
+            value = prop.get(prop_type)
+            new_value = eval_value(prop_type, value)
+            props[_normalize(name)] = _normalize(str(new_value))
 
-    def transform(val, replace):
-        if "{{" in val and "}}" in val:
-            uval = unicodedata.normalize("NFC", val).replace("’", "'")
+        def transform(val, replace):
+            compiled = self.strings.get(val)
+            if compiled is None:
+                return val
+            return compiled.render(props, data, replace)
 
-            if "(" in uval and ")" in uval:
-                fun_name = uval.split("(")[0].split("{{")[1]
-                fun = getattr(functions, fun_name, None)
-                if fun:
-                    expr = uval.split("('")[1].split(")'")[0]
-                    jsonpath_expression = parse(expr)
-                    matches = [match for match in jsonpath_expression.find(data)]
-                    new_block = fun(matches, eval_property_value=eval_value)
-                    replace(new_block)
+        with Walker(transform) as walker:
+            walker.walk_dict(template)
 
-            for token, new_value in props.items():
-                utoken = unicodedata.normalize("NFC", token).replace("’", "'")
-                uval = unicodedata.normalize("NFC", val).replace("’", "'")
-                val = uval.replace(utoken, new_value)
+        template.pop("request_id", None)
 
-        return val
+        return template
 
-    with Walker(transform) as walker:
-        walker.walk_dict(template)
 
-    template.pop("request_id", None)
+COMPILED_TEMPLATES = LRUCache(maxsize=32)
 
-    return template
+
+def compile_template(template) -> CompiledTemplate:
+    """Compile the template, or reuse it if this version was already compiled."""
+    key = (template.get("id"), template.get("last_edited_time"))
+    if None in key:
+        return CompiledTemplate(template)
+
+    compiled = COMPILED_TEMPLATES.get(key)
+    if compiled is None:
+        compiled = CompiledTemplate(template)
+        COMPILED_TEMPLATES.set(key, compiled)
+    return compiled
+
+
+def _fill_template_with_data(template, data, parent_id, title):
+    return compile_template(template).render(data, parent_id, title)
 
 
 def main():
@@ -298,7 +415,15 @@ def main():
         job_desc = json.load(fp)
 
     applier = NotionTemplateApplier(**job_desc)
-    applier.apply()
+    if applier.database_item_id:
+        applier.apply()
+        return
+
+    report = applier.apply_batch()
+    for created in report["created"]:
+        print(created["url"])
+    for failed in report["failed"]:
+        print(f"{failed['item']}: {failed['error']}")
 
 
 def test():
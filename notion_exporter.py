@@ -2,12 +2,18 @@ import json
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 from slugify import slugify
 
+from block_store import BlockStore
+from cache import LRUCache
 from crawler import Crawler
+from database_sink import chunked, database_schema, open_sink
+from dump_writer import StreamingJsonWriter, encode
+from export_index import ExportIndex
 from notion_client import NotionApiClient, format_id
 
 
@@ -36,7 +42,22 @@ def document_title(obj):
     )
 
 
+def search_result_item(result):
+    """The frontier item of a page or database found with the search endpoint."""
+    kind = result.get("object")
+    parent = result.get("parent", {})
+    parent_id = parent.get(parent.get("type"))
+    return {
+        "type": kind,
+        "id": result.get("id"),
+        "title": object_title(result) if kind == "database" else document_title(result),
+        "parent": parent_id if isinstance(parent_id, str) else None,
+    }
+
+
 class NotionBaseCrawler(Crawler):
+    LINK_TYPES = {"child_page": "page", "child_database": "database"}
+
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
 
@@ -56,34 +77,111 @@ class NotionBaseCrawler(Crawler):
 
 
 class NotionExportCrawler(NotionBaseCrawler):
-    def __init__(self, token, **kwargs) -> None:
-        self.client = NotionApiClient(token)
+    MAX_WORKERS = 4
+    TITLE_CACHE_SIZE = 10000
+    TITLE_CACHE_TTL = 3600
+    ROWS_CHUNK_SIZE = 1000
+
+    def __init__(
+        self,
+        token,
+        max_workers: int = MAX_WORKERS,
+        client_options: Dict = None,
+        incremental: bool = False,
+        compact_json: bool = False,
+        discover: bool = False,
+        databases: Dict = None,
+        block_store: bool = False,
+        **kwargs,
+    ) -> None:
+        """
+        With `discover`, all the pages and databases shared with the
+        integration are enqueued before crawling (see discover_workspace).
+        `databases` maps database ids (or "*", for all the others) to their
+        export rule: a "filter" and "sorts" for their query, the
+        "filter_properties" to export, "properties_only" to export the items
+        without their blocks, and "sink" ("ndjson" or "parquet") to export
+        them as rows of a columnar file instead.
+        With `block_store`, the blocks of the pages are stored once in a
+        BlockStore shared by all the runs, and each run records a snapshot.
+        """
+        client_options = dict(client_options or {})
+        client_options.setdefault("pool_size", max_workers)
+        self.client = NotionApiClient(token, **client_options)
+        self.max_workers = max_workers
+        self.incremental = incremental
+        self.compact_json = compact_json
+        self.discover = discover
+        self.databases = {
+            key if key == "*" else format_id(key): rule
+            for key, rule in (databases or {}).items()
+        }
+        self.titles = LRUCache(self.TITLE_CACHE_SIZE, self.TITLE_CACHE_TTL)
         super().__init__(**kwargs)
+        self.index = ExportIndex(self.export_folder)
+        self.blocks = BlockStore(self.export_folder) if block_store else None
+        # the pages dumped, or found unchanged, by this run: its snapshot
+        self.seen = set()
 
     def compute_buffer(self):
         self.buffer = {}
 
     def compute_visited(self):
         self.visited = {}
+        if ExportIndex.exists(self.export_folder):
+            for uid, entry in ExportIndex(self.export_folder).entries():
+                if entry.get("type") in ("page", "database"):
+                    self.visited[uid] = {"path": entry.get("path")}
+            return
+
         path_expr = self._relative_file_path("*.json")
         for filepath in glob(path_expr):
             uid = filepath[-41:-5]
-            self.visited[uid] = filepath
-
-    def dump(self, object_id, title, data):
-        title = slugify(title)[:64] if title else None
-        prefix = f"{title}-" if title else ""
-        fp = self._relative_file_path(f"{prefix}{format_id(object_id)}.json")
+            self.visited[uid] = {"path": filepath}
 
-        if os.path.exists(fp):
-            with open(fp) as fd:
-                backup = dict(json.load(fd))
-                backup.update(data)
-                data = backup
-
-        with open(fp, "w") as fd:
-            json.dump(data, fd)
+    def _dump_name(self, object_id, title):
+        slug = slugify(title)[:64] if title else None
+        prefix = f"{slug}-" if slug else ""
+        return self._relative_file_path(f"{prefix}{format_id(object_id)}")
 
+    def dump(self, object_id, title, data, children: Iterable[Dict] = None):
+        """
+        Write `data` to the export folder. When given, `children` is streamed
+        to the file as the "children" entry of `data`, one block at a time.
+        The file is replaced atomically.
+        """
+        fp = f"{self._dump_name(object_id, title)}.json"
+        stored = {}
+
+        if children is not None and self.blocks is not None:
+            # the dump holds the hashes of the blocks, and so does the page
+            # stored for the snapshots
+            hashes = [self.blocks.put(child) for child in children]
+            data = dict(data, children=hashes, block_store=True)
+            stored["hash"] = self.blocks.put_object(data)
+            self.seen.add(format_id(object_id))
+            children = None
+
+        if children is None:
+            tmp_path = f"{fp}.tmp"
+            with open(tmp_path, "wb") as fd:
+                fd.write(encode(data, self.compact_json))
+            os.replace(tmp_path, fp)
+        else:
+            with StreamingJsonWriter(fp, data, compact=self.compact_json) as writer:
+                for child in children:
+                    writer.append(child)
+
+        parent = data.get("parent") or {}
+        self.index.update(
+            object_id,
+            path=fp,
+            type=data.get("object"),
+            title=title,
+            parent=parent.get(parent.get("type")),
+            last_edited_time=data.get("last_edited_time"),
+            **stored,
+        )
         return fp
 
     def debug_block(self, block):
@@ -92,74 +190,427 @@ class NotionExportCrawler(NotionBaseCrawler):
             values[prop] = block.get(prop)
         return values
 
+    def _needs_children(self, block):
+        block_type = block.get("type", None)
+        return block.get("has_children") and block_type not in (
+            "child_page",
+            "child_database",
+        )
+
+    def _prefetch_children(self, block_id, executor):
+        pages = self.client.paginate_children_block_pages(block_id)
+        return pages, executor.submit(next, pages, [])
+
+    def _iter_prefetched(self, prefetched, executor):
+        """
+        Yield (block, prefetched children) for the given pages of results.
+        The first page of children of every block of a page of results is
+        fetched concurrently (the client enforces the rate limit).
+        """
+        pages, first_page = prefetched
+        blocks = first_page.result()
+        while blocks is not None:
+            children = [
+                self._prefetch_children(block.get("id"), executor)
+                if self._needs_children(block)
+                else None
+                for block in blocks
+            ]
+            yield from zip(blocks, children)
+            blocks = next(pages, None)
+
+    def walk_block_tree(self, block_id) -> Iterator[Tuple[int, str, Dict]]:
+        """
+        Lazily yield (depth, parent_id, block) for every block below the given
+        one, depth first, in document order, as pages of results come in.
+        Blocks are yielded without their children attached.
+        Adds page and database blocks to the buffer.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            prefetched = self._prefetch_children(block_id, executor)
+            stack = [(0, block_id, self._iter_prefetched(prefetched, executor))]
+            while stack:
+                depth, parent_id, siblings = stack[-1]
+                entry = next(siblings, None)
+                if entry is None:
+                    stack.pop()
+                    continue
+
+                block, children = entry
+                self.extract_next_page_to_visit(block)
+                yield depth, parent_id, block
+
+                if children is not None:
+                    siblings = self._iter_prefetched(children, executor)
+                    stack.append((depth + 1, block.get("id"), siblings))
+
+    def iter_children_blocks(self, block_id) -> Iterator[Dict]:
+        """
+        Yield the children blocks of the given block, each with its whole
+        subtree attached. Only one subtree is held in memory at a time.
+        """
+        current, parents = None, {}
+        for depth, parent_id, block in self.walk_block_tree(block_id):
+            if depth == 0:
+                if current is not None:
+                    yield current
+                current, parents = block, {}
+            else:
+                parent = parents[parent_id]
+                parent[parent.get("type")]["children"].append(block)
+
+            if self._needs_children(block):
+                block[block.get("type")]["children"] = block.get("children", [])
+                parents[block.get("id")] = block
+
+        if current is not None:
+            yield current
+
     def process_single_block(self, block_id, children_blocks=None) -> List[Dict]:
         """
-        Exhaustively (and recursively) return all the children blocks of the given block.
+        Exhaustively return all the children blocks of the given block.
         Adds page and database blocks to the buffer.
         """
         children_blocks = children_blocks if children_blocks else []
-        for block in self.client.paginate_children_blocks(block_id):
-            self.extract_next_page_to_visit(block)
-            self.extract_children_blocks(block)
-            children_blocks.append(block)
+        children_blocks.extend(self.iter_children_blocks(block_id))
         return children_blocks
 
+    def _relation_properties(self, pages):
+        for page in pages:
+            for prop in page.get("properties", {}).values():
+                if prop.get("type") == "relation":
+                    yield prop
+
+    def _fetch_title(self, item_id):
+        block = self.client.get_block(item_id)
+        block_type = block.get("type")
+        if not block_type:
+            logging.warning(f"Unable to resolve the relation to {item_id}: {block}")
+            return None
+        return block[block_type]["title"]
+
+    def resolve_relations(self, pages):
+        """
+        Replace the relation properties of the given pages with the titles of
+        the related pages. Every distinct related page is fetched once, and
+        concurrently; titles are cached across calls.
+        """
+        props = list(self._relation_properties(pages))
+        item_ids = {
+            relation.get("id") for prop in props for relation in prop["relation"]
+        }
+        missing = [uid for uid in item_ids if uid and uid not in self.titles]
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for item_id, title in zip(
+                    missing, executor.map(self._fetch_title, missing)
+                ):
+                    if title is not None:
+                        self.titles[item_id] = title
+
+        for prop in props:
+            resolved = []
+            for relation in prop["relation"]:
+                title = self.titles.get(relation.get("id"))
+                if title is None:
+                    resolved.append(relation)
+                else:
+                    resolved.append(
+                        {"type": "title", "title": title, "id": relation.get("id")}
+                    )
+            prop["relation"] = resolved
+
     def resolve_properties(self, block):
-        props = block.get("properties", {})
-        for name, prop in props.items():
-            prop_type = prop.get("type")
-            if prop_type in ("relation"):
-                item_id = next(iter(prop[prop["type"]]), {}).get("id")
-                if item_id:
-                    block = self.client.get_block(item_id)
-                    value = block[block["type"]]["title"]
-                    prop[prop_type] = [{"type": "title", "title": value}]
+        self.resolve_relations([block])
 
     def extract_children_blocks(self, block):
         block_type = block.get("type", None)
-        has_children = block.get("has_children")
 
-        if has_children and block_type not in ("child_page", "child_database"):
+        if self._needs_children(block):
             children = self.process_single_block(
                 block.get("id"), block.get("children", [])
             )
             block[block_type]["children"] = children
 
+    def _collect_links(self, blocks):
+        links, stack = [], list(blocks)
+        while stack:
+            block = stack.pop()
+            block_type = block.get("type")
+            if block_type in self.LINK_TYPES:
+                kind = self.LINK_TYPES[block_type]
+                links.append([kind, block.get("id"), self._child_title(block)])
+            else:
+                stack.extend(block.get(block_type, {}).get("children", []))
+        return links
+
+    def _enqueue_known_links(self, uid):
+        for kind, link_id, title in (self.index.get(uid) or {}).get("links", []):
+            self.append_to_buffer(kind, link_id, title)
+
+    def _page_unchanged(self, page_id, page):
+        if not self.incremental:
+            return False
+        if not self.index.is_unchanged(page_id, page.get("last_edited_time")):
+            return False
+        logging.info(f"The page {page_id} did not change. Skipping.")
+        self.seen.add(format_id(page_id))
+        self._enqueue_known_links(page_id)
+        return True
+
+    def _dump_page(self, page_id, title, page, blocks: Iterable[Dict]):
+        title = title if title else object_title(**title_property(page))
+        links = []
+
+        def tracked():
+            for block in blocks:
+                links.extend(self._collect_links([block]))
+                yield block
+
+        path = self.dump(page_id, title, page, children=tracked())
+        self.index.update(page_id, links=links)
+        return path
+
     def crawl_page(self, page_id, title=None, **kwargs):
         page = self.client.get_page(page_id)
         if page.get("archived"):
             logging.warning(f"The page {page.get('url')} is archived. Skipping.")
             return
 
-        blocks = self.process_single_block(page_id)
-        page["children"] = blocks
+        if self._page_unchanged(page_id, page):
+            return self.index.get(page_id)["path"]
+
+        self._project_properties(page)
         self.resolve_properties(page)
-        title = title if title else object_title(**title_property(page))
+        blocks = self.iter_children_blocks(page_id)
 
-        return self.dump(page_id, title, page)
+        return self._dump_page(page_id, title, page, blocks)
 
     def crawl_database_item(self, item_id, title=None, **kwargs):
         blocks = self.process_single_block(item_id)
         return self.dump(item_id, title, {"blocks": blocks})
 
-    def crawl_database(self, database_id, title=None, **kwargs):
-        database = self.client.get_database(database_id)
+    def _edited_since(self, watermark):
+        return {
+            "timestamp": "last_edited_time",
+            "last_edited_time": {"on_or_after": watermark},
+        }
+
+    def _database_rule(self, database_id):
+        return self.databases.get(format_id(database_id), self.databases.get("*", {}))
 
-        items = list(self.client.paginate_children_items(database_id))
+    def _database_query(self, database_id, database):
+        """
+        Return the index entry of the database and the paginate_children_items
+        arguments to query its items, following its export rule.
+        """
+        rule = self._database_rule(database_id)
+        # the rows sinks are rewritten as a whole
+        incremental = self.incremental and not rule.get("sink")
+        known = (self.index.get(database_id) or {}) if incremental else {}
+        watermark = known.get("watermark")
+
+        filters = [rule.get("filter")]
+        if watermark:
+            filters.append(self._edited_since(watermark))
+        filters = [f for f in filters if f]
+        query = {}
+        if filters:
+            query["filter"] = {
+                "filter": filters[0] if len(filters) == 1 else {"and": filters}
+            }
+        if rule.get("sorts"):
+            query["sort_order"] = {"sorts": rule["sorts"]}
+        if rule.get("filter_properties"):
+            # properties may be given by name or by id
+            properties = database.get("properties", {})
+            query["filter_properties"] = [
+                properties.get(name, {}).get("id", name)
+                for name in rule["filter_properties"]
+            ]
+        return known, query
+
+    def _members_query(self, database_id, query):
+        """
+        The paginate_children_items arguments listing all the items of the
+        database (under its rule filter), as cheaply as the API allows: the
+        items come with their title property only.
+        """
+        rule = self._database_rule(database_id)
+        members = {"filter_properties": ["title"]}
+        if rule.get("filter"):
+            members["filter"] = {"filter": rule["filter"]}
+        if query.get("sort_order"):
+            members["sort_order"] = query["sort_order"]
+        return members
+
+    def _project_properties(self, page):
+        """
+        Keep only the "filter_properties" of the rule of the database of the
+        page, if it is a database item.
+        """
+        parent = page.get("parent") or {}
+        if parent.get("type") != "database_id":
+            return
+        wanted = self._database_rule(parent["database_id"]).get("filter_properties")
+        if not wanted:
+            return
+        wanted = set(wanted)
+        page["properties"] = {
+            name: prop
+            for name, prop in page.get("properties", {}).items()
+            if name in wanted or prop.get("id") in wanted
+        }
+
+    def _dump_item_properties(self, database_id, item, title):
+        """Dump an item of a database as a page without its blocks."""
+        item_id = item.get("id")
+        if item_id in self.visited:
+            return
+        self.dump(item_id, title, dict(item, children=[]))
+        self._mark_visited(
+            item_id, {"type": "page", "title": title, "parent": database_id}
+        )
+
+    def _dump_database(
+        self, database_id, title, database, items, known, members=None
+    ):
+        """
+        `members` lists the ids of all the items of the database, when
+        `items` are only the ones edited since the previous export.
+        """
+        properties_only = self._database_rule(database_id).get("properties_only")
+        watermark = known.get("watermark")
         for item in items:
+            item_title = object_title(**title_property(item))
+            if properties_only:
+                self._dump_item_properties(database_id, item, item_title)
+            else:
+                self.append_to_buffer("page", item.get("id"), item_title)
+            watermark = max(watermark or "", item.get("last_edited_time") or "")
+
+        item_ids = [item["id"] for item in items]
+        if members is not None:
+            # unchanged items are not refetched, but their sub-pages might have changed
+            changed = set(item_ids)
+            for item_id in members:
+                if item_id not in changed:
+                    self.seen.add(format_id(item_id))
+                    self._enqueue_known_links(item_id)
+            removed = set(known.get("items", [])) - set(members) - changed
+            if removed:
+                logging.info(f"{len(removed)} items left the database {database_id}")
+            member_ids = set(members)
+            item_ids = members + [i for i in item_ids if i not in member_ids]
+
+        database["items"] = item_ids
+
+        title = title if title else object_title(database)
+        path = self.dump(database_id, title, database)
+        self.index.update(database_id, watermark=watermark or None, items=item_ids)
+        return path
+
+    def _dump_database_rows(self, database_id, title, database, items):
+        """
+        Write the items of the database into the columnar file of its rule
+        "sink", rather than crawling them as pages. Items are streamed.
+        """
+        rule = self._database_rule(database_id)
+        title = title if title else object_title(database)
+        with open_sink(
+            rule["sink"],
+            self._dump_name(database_id, title),
+            database_schema(database),
+            compact=self.compact_json,
+        ) as sink:
+            for chunk in chunked(items, self.ROWS_CHUNK_SIZE):
+                self.resolve_relations(chunk)
+                sink.write(chunk)
+
+        database["rows"] = {
+            "format": rule["sink"],
+            "path": os.path.basename(sink.path),
+            "count": sink.count,
+        }
+        path = self.dump(database_id, title, database)
+        self.index.update(database_id, rows=sink.path)
+        return path
+
+    def crawl_database(self, database_id, title=None, **kwargs):
+        database = self.client.get_database(database_id)
+        known, query = self._database_query(database_id, database)
+        items = self.client.paginate_children_items(database_id, **query)
+        if self._database_rule(database_id).get("sink"):
+            return self._dump_database_rows(database_id, title, database, items)
+
+        items = list(items)
+        members = None
+        if known.get("watermark"):
+            # the items deleted, archived or moved out of the database since
+            # the previous export are not in the list of the edited ones
+            members = [
+                item["id"]
+                for item in self.client.paginate_children_items(
+                    database_id, **self._members_query(database_id, query)
+                )
+            ]
+        # the items are crawled as pages later on: warm the title cache in one go
+        self.resolve_relations(items)
+        return self._dump_database(database_id, title, database, items, known, members)
+
+    def discover_workspace(self):
+        """
+        Enqueue the pages and databases listed by the search endpoint, in
+        bulk, rather than finding them page after page in the block trees.
+        When incremental, the pages unchanged since the last export are not.
+        """
+        count = 0
+        for result in self.client.paginate_search():
+            if result.get("archived"):
+                continue
+            item = search_result_item(result)
+            if (
+                self.incremental
+                and item["type"] == "page"
+                and self.index.is_unchanged(item["id"], result.get("last_edited_time"))
+            ):
+                self.seen.add(format_id(item["id"]))
+                continue
             self.append_to_buffer(
-                "page",
-                item.get("id"),
-                object_title(**title_property(item)),
+                item["type"], item["id"], item["title"], item["parent"]
             )
+            count += 1
+        logging.info(f"Discovered {count} pages and databases to crawl")
 
-        database["items"] = [item["id"] for item in items]
+    def crawl(self):
+        if self.discover:
+            self.discover_workspace()
+        super().crawl()
 
-        title = title if title else object_title(database)
-        return self.dump(database_id, title, database)
+    def _persist_buffer_and_history(self):
+        super()._persist_buffer_and_history()
+        self.index.save()
+
+    def snapshot(self):
+        """
+        Record the hashes of the pages dumped or found unchanged by this run:
+        the pages deleted since the previous one are not in its snapshot.
+        """
+        pages = {}
+        for uid in self.seen:
+            digest = (self.index.get(uid) or {}).get("hash")
+            if digest:
+                pages[uid] = digest
+        path = self.blocks.snapshot(pages)
+        logging.info(
+            f"Snapshot {path}: {len(pages)} pages, {self.blocks.written} new blocks"
+        )
 
     def tear_down(self):
-        pass
+        if self.blocks is not None:
+            self.snapshot()
+        self.index.save()
+        logging.info(f"API calls: {dict(self.client.stats)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from typing import Dict, List
+
+from crawler import Crawler
+from export_index import ExportIndex
+from notion_client import NotionApiClient
+from notion_exporter import NotionExportCrawler, search_result_item
+from shared_frontier import SharedFrontier, WorkerFrontier
+
+# the Notion rate limit (per integration token) and the client default burst
+RATE, BURST = 3, 5
+JOB_KEYS = (
+    "token",
+    "tokens",
+    "workers",
+    "root_pages",
+    "export_folder",
+    "resume",
+    "frontier",
+    "client_options",
+    "discover",
+)
+
+
+def shard_name(worker: int) -> str:
+    return f"shard-{worker}"
+
+
+def open_frontier(job_desc: Dict) -> SharedFrontier:
+    export_folder = job_desc.get("export_folder", Crawler.EXPORT_FOLDER)
+    path = os.path.join(export_folder, SharedFrontier.FILENAME)
+    return SharedFrontier(path, **job_desc.get("frontier", {}))
+
+
+def _worker_count(job_desc: Dict) -> int:
+    return job_desc.get("workers") or os.cpu_count()
+
+
+def _client_options(job_desc: Dict, worker: int) -> Dict:
+    """
+    The workers using the same token share its rate budget: each of them
+    gets its part of it.
+    """
+    tokens = job_desc.get("tokens") or [job_desc["token"]]
+    sharing = len(range(worker % len(tokens), _worker_count(job_desc), len(tokens)))
+    options = dict(job_desc.get("client_options") or {})
+    options["rate"] = options.get("rate", RATE) / sharing
+    options["burst"] = max(1, options.get("burst", BURST) // sharing)
+    return options
+
+
+class ShardWorker(NotionExportCrawler):
+    """
+    A worker of a sharded export: crawls the items it claims from the
+    frontier shared by all the workers, with its own token and rate budget,
+    into its own folder of the export (its shard).
+    """
+
+    def __init__(
+        self, token, shared: SharedFrontier, worker: int, export_folder: str, **kwargs
+    ) -> None:
+        self.shard = shard_name(worker)
+        super().__init__(
+            token,
+            root_pages=[],
+            export_folder=os.path.join(export_folder, self.shard),
+            **kwargs,
+        )
+        self.shared = shared
+        self.buffer = WorkerFrontier(shared, self.shard)
+        self._failed = set()
+
+    def _heartbeat(self, uid, stop):
+        while not stop.wait(self.shared.lease / 3):
+            if not self.shared.renew(uid, self.shard):
+                logging.warning(f"Lost the lease of {uid}")
+
+    def _crawl_claimed(self, crawl, uid, **kwargs):
+        """
+        Crawl an item claimed from the shared frontier, renewing its lease
+        meanwhile. When the crawl raises, the item is handed back to the
+        frontier (to be attempted again, by any worker) and the worker goes
+        on with the next one.
+        """
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(uid, stop), daemon=True
+        )
+        heartbeat.start()
+        try:
+            return crawl(uid, **kwargs)
+        except Exception as exc:
+            logging.exception(f"Unable to crawl {uid}: handing it back")
+            self._failed.add(uid)
+            self.shared.fail(uid, repr(exc))
+        except BaseException:
+            self.shared.release(uid)
+            raise
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    def crawl_page(self, page_id, **kwargs):
+        return self._crawl_claimed(super().crawl_page, page_id, **kwargs)
+
+    def crawl_database(self, database_id, **kwargs):
+        return self._crawl_claimed(super().crawl_database, database_id, **kwargs)
+
+    def _mark_visited(self, uid, item):
+        if uid in self._failed:
+            self._failed.discard(uid)
+            return
+        super()._mark_visited(uid, item)
+        self.shared.done(uid)
+
+
+def _discover(job_desc: Dict, shared: SharedFrontier):
+    tokens = job_desc.get("tokens") or [job_desc["token"]]
+    client = NotionApiClient(tokens[0], **job_desc.get("client_options", {}))
+    try:
+        for result in client.paginate_search():
+            if not result.get("archived"):
+                shared.push(search_result_item(result))
+    finally:
+        client.close()
+
+
+def seed(job_desc: Dict):
+    """Prepare the shared frontier: a new export, or resume the last one."""
+    export_folder = job_desc.get("export_folder", Crawler.EXPORT_FOLDER)
+    if not os.path.isdir(export_folder):
+        os.makedirs(export_folder)
+
+    shared = open_frontier(job_desc)
+    try:
+        if job_desc.get("resume"):
+            shared.release_all()
+        else:
+            shared.clear()
+        for item in job_desc.get("root_pages", []):
+            shared.push(dict(item))
+        if job_desc.get("discover"):
+            _discover(job_desc, shared)
+    finally:
+        shared.close()
+
+
+def run_worker(job_desc: Dict, worker: int) -> str:
+    tokens = job_desc.get("tokens") or [job_desc["token"]]
+    options = {key: value for key, value in job_desc.items() if key not in JOB_KEYS}
+    shared = open_frontier(job_desc)
+    try:
+        crawler = ShardWorker(
+            tokens[worker % len(tokens)],
+            shared,
+            worker,
+            job_desc.get("export_folder", Crawler.EXPORT_FOLDER),
+            client_options=_client_options(job_desc, worker),
+            **options,
+        )
+        crawler.crawl()
+    finally:
+        shared.close()
+    return crawler.shard
+
+
+def merge_manifests(export_folder: str, shards: List[str] = None):
+    """Merge the manifests of the shards into the manifest of the export."""
+    if shards is None:
+        shards = [
+            os.path.basename(folder)
+            for folder in sorted(glob(os.path.join(export_folder, shard_name("*"))))
+        ]
+
+    index = ExportIndex(export_folder)
+    try:
+        for shard in shards:
+            shard_folder = os.path.join(export_folder, shard)
+            if ExportIndex.exists(shard_folder):
+                shard_index = ExportIndex(shard_folder)
+                index.merge(shard_index, shard=shard)
+                shard_index.close()
+    finally:
+        index.close()
+
+
+def export_sharded(job_desc: Dict):
+    """
+    Export with `workers` processes pulling from a shared frontier, each
+    one with a token of `tokens` (round robin), into a folder per worker.
+    The manifest of the export then indexes the dumps of all the shards.
+    """
+    seed(job_desc)
+    workers = _worker_count(job_desc)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        shards = list(pool.map(run_worker, [job_desc] * workers, range(workers)))
+    merge_manifests(job_desc.get("export_folder", Crawler.EXPORT_FOLDER), shards)
+
+    shared = open_frontier(job_desc)
+    failed = shared.failed()
+    shared.close()
+    for uid, error in failed.items():
+        logging.error(f"Gave up crawling {uid}: {error}")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+
+    # job_desc.json: run all the workers here
+    # job_desc.json seed|worker <n>|merge: when the workers run on several hosts
+    with open(sys.argv[1]) as fp:
+        job_desc = json.load(fp)
+
+    command = sys.argv[2] if len(sys.argv) > 2 else None
+    if command == "seed":
+        seed(job_desc)
+    elif command == "worker":
+        run_worker(job_desc, int(sys.argv[3]))
+    elif command == "merge":
+        merge_manifests(job_desc.get("export_folder", Crawler.EXPORT_FOLDER))
+    else:
+        export_sharded(job_desc)
@@ -0,0 +1,157 @@
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Tuple
+
+from notion_client import NotionApiClient, NotionApiError
+
+# Notion limits, per request
+MAX_CHILDREN = 100
+MAX_BLOCKS = 1000
+MAX_NESTING = 2
+MAX_PAYLOAD = 500 * 1000
+
+
+def _children(block):
+    return block.get(block.get("type"), {}).get("children") or []
+
+
+def _with_children(block, children):
+    """Shallow copy of block, with the given children."""
+    block_type = block.get("type")
+    copied = {key: value for key, value in block.items() if key != "children"}
+    body = {
+        key: value
+        for key, value in block.get(block_type, {}).items()
+        if key != "children"
+    }
+    if children:
+        body["children"] = children
+    copied[block_type] = body
+    return copied
+
+
+class PageWriter(object):
+    """
+    Creates pages too large for a single create_page call: the page is
+    created without its blocks, which are then appended in batches that fit
+    the Notion limits (children per array, blocks and nesting levels per
+    request, payload size). The subtrees that do not fit are appended to
+    their parent block once it exists, independent subtrees concurrently.
+    """
+
+    def __init__(
+        self,
+        client: NotionApiClient,
+        max_workers=4,
+        max_children=MAX_CHILDREN,
+        max_blocks=MAX_BLOCKS,
+        max_nesting=MAX_NESTING,
+        max_payload=MAX_PAYLOAD,
+    ) -> None:
+        self.client = client
+        self.max_workers = max_workers
+        self.max_children = max_children
+        self.max_blocks = max_blocks
+        self.max_nesting = max_nesting
+        self.max_payload = max_payload
+
+    def create_page(self, page: Dict) -> Dict:
+        children = page.get("children") or []
+        batch, deferred = self._next_batch(children)
+        if len(batch) == len(children) and not deferred:
+            return self._check(self.client.create_page(page))
+
+        shell = {key: value for key, value in page.items() if key != "children"}
+        response = self._check(self.client.create_page(shell))
+        self.append(response["id"], children)
+        return response
+
+    def append(self, parent_id, blocks: List[Dict]):
+        """Append blocks, with their whole subtrees, to the given block or page."""
+        if not blocks:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self._append_batch, parent_id, blocks)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for job in future.result():
+                        pending.add(executor.submit(self._append_batch, *job))
+
+    def _check(self, response):
+        if response.get("object") == "error":
+            raise NotionApiError(
+                f"{response.get('status')} {response.get('code')}: {response.get('message')}"
+            )
+        return response
+
+    def _inline(self, block, level, budget) -> Tuple[Dict, List]:
+        """
+        Return a copy of block holding the part of its subtree that fits
+        in the request, and the (path, children) left to append afterwards,
+        path being the indexes leading to their parent from block.
+        """
+        children = _children(block)
+        if not children:
+            return block, []
+
+        kept, deferred = [], []
+        for index, child in enumerate(children):
+            if (
+                level >= self.max_nesting
+                or index >= self.max_children
+                or budget[0] <= 0
+            ):
+                deferred.append(((), children[index:]))
+                break
+            budget[0] -= 1
+            inlined, child_deferred = self._inline(child, level + 1, budget)
+            kept.append(inlined)
+            deferred.extend(((index, *path), rest) for path, rest in child_deferred)
+        return _with_children(block, kept), deferred
+
+    def _next_batch(self, blocks):
+        """Return the payload of the next request, and what it leaves out."""
+        batch, deferred, size = [], [], 0
+        budget = [self.max_blocks]
+        for index, block in enumerate(blocks[: self.max_children]):
+            budget[0] -= 1
+            # the blocks of the request are the first of its nesting levels
+            inlined, block_deferred = self._inline(block, 1, budget)
+            block_size = len(json.dumps(inlined))
+            if batch and (budget[0] < 0 or size + block_size > self.max_payload):
+                break
+            batch.append(inlined)
+            deferred.extend(((index, *path), rest) for path, rest in block_deferred)
+            size += block_size
+        return batch, deferred
+
+    def _resolve(self, results, path, listings):
+        block_id = results[path[0]]["id"]
+        for index in path[1:]:
+            if block_id not in listings:
+                listings[block_id] = list(self.client.paginate_children_blocks(block_id))
+            block_id = listings[block_id][index]["id"]
+        return block_id
+
+    def _append_batch(self, parent_id, blocks):
+        """
+        Append the next batch of blocks to parent_id, and return the
+        (parent id, blocks) jobs left: the rest of blocks, and the subtrees
+        of the batch that did not fit.
+        """
+        batch, deferred = self._next_batch(blocks)
+        logging.debug(f"Appending {len(batch)} blocks to {parent_id}")
+        response = self._check(self.client.append_block_children(parent_id, batch))
+        results = response.get("results", [])
+
+        jobs = []
+        if len(batch) < len(blocks):
+            jobs.append((parent_id, blocks[len(batch) :]))
+
+        listings = {}
+        for path, rest in deferred:
+            jobs.append((self._resolve(results, path, listings), rest))
+        return jobs
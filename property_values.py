@@ -0,0 +1,144 @@
+import logging
+from typing import Dict, Iterable, List, Optional
+
+
+def rich_text_value(value):
+    if isinstance(value, str):
+        return value
+    return "".join(segment.get("plain_text", "") for segment in value)
+
+
+def date_value(value):
+    computed = (
+        "{start}->{end}".format(**value)
+        if value.get("end")
+        else "{start}".format(**value)
+    )
+
+    tz = value.get("time_zone")
+    if tz:
+        computed = f"{computed} ({tz})"
+
+    return computed
+
+
+def identity(value):
+    return value
+
+
+def name_value(value):
+    return value["name"]
+
+
+def names_value(value):
+    return ", ".join(option["name"] for option in value)
+
+
+def user_value(value):
+    return value.get("name") or value.get("id")
+
+
+def people_value(value):
+    return ", ".join(str(user_value(user)) for user in value)
+
+
+def files_value(value):
+    return ", ".join(
+        file.get("name") or file.get(file.get("type"), {}).get("url", "")
+        for file in value
+    )
+
+
+def unique_id_value(value):
+    prefix = value.get("prefix")
+    return f"{prefix}-{value['number']}" if prefix else value["number"]
+
+
+def typed_value(value):
+    """Formulas, rollups: objects holding a value of their own type."""
+    return evaluate(value["type"], value[value["type"]])
+
+
+def array_value(value):
+    return ", ".join(str(evaluate(val["type"], val[val["type"]])) for val in value)
+
+
+def relation_value(value):
+    if value:
+        return ", ".join(
+            str(evaluate(val["type"], val[val["type"]]) if "type" in val else val["id"])
+            for val in value
+        )
+
+
+# how to display the value of each type of property; not memoized: keying
+# a memo on these (unhashable) values costs more than evaluating them
+EVALUATORS = {
+    "title": rich_text_value,
+    "rich_text": rich_text_value,
+    "number": identity,
+    "checkbox": identity,
+    "url": identity,
+    "email": identity,
+    "phone_number": identity,
+    "string": identity,
+    "boolean": identity,
+    "created_time": identity,
+    "last_edited_time": identity,
+    "date": date_value,
+    "select": name_value,
+    "status": name_value,
+    "multi_select": names_value,
+    "people": people_value,
+    "created_by": user_value,
+    "last_edited_by": user_value,
+    "files": files_value,
+    "unique_id": unique_id_value,
+    "formula": typed_value,
+    "rollup": typed_value,
+    "array": array_value,
+    "relation": relation_value,
+}
+
+
+def evaluate(prop_type, value):
+    """The value of a property of the given type, as displayed in a page."""
+    if value is None:
+        return None
+    func = EVALUATORS.get(prop_type, repr)
+    try:
+        return func(value)
+    except (KeyError, TypeError, AttributeError):
+        logging.exception(
+            f"Unexpected exception evaluating '{value}' of type '{prop_type}'"
+        )
+        return value
+
+
+def property_value(prop: Dict):
+    return evaluate(prop["type"], prop[prop["type"]])
+
+
+def evaluate_items(
+    items: Iterable[Dict], columns: Optional[List[str]] = None, evaluate_value=None
+) -> Dict[str, List]:
+    """
+    Evaluate the properties of many pages (the items of a database) at once.
+    Return the values of each column, one per item ("" when an item lacks
+    the property). By default, the columns are all the item properties.
+    """
+    evaluate_value = evaluate_value or evaluate
+    properties = [item.get("properties", {}) for item in items]
+    if columns is None:
+        columns = list(dict.fromkeys(name for props in properties for name in props))
+
+    values = {}
+    for name in columns:
+        column = values[name] = []
+        for props in properties:
+            prop = props.get(name)
+            if prop is None:
+                column.append("")
+            else:
+                column.append(evaluate_value(prop["type"], prop[prop["type"]]))
+    return values
@@ -0,0 +1,78 @@
+import asyncio
+import random
+import threading
+import time
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def parse_retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket.
+
+    Allows bursts of up to `capacity` calls, then `rate` calls per second.
+    The rate is adaptive: `throttle` halves it (down to `min_rate`) and
+    pauses every caller, `recover` grows it back to its nominal value.
+    """
+
+    def __init__(self, rate: float = 3, capacity: float = 5, min_rate: float = 0.5):
+        self.nominal_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        """Take a token, return how long the caller has to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def throttle(self, pause=None):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            if pause:
+                self.paused_until = max(self.paused_until, now + pause)
+
+    def recover(self):
+        if self.rate >= self.nominal_rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = min(self.nominal_rate, self.rate + 0.1)
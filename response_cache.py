@@ -0,0 +1,179 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+CHILDREN_PATH = re.compile(r"^blocks/([^/?]+)/children")
+OBJECT_PATH = re.compile(r"^(?:pages|blocks|databases)/([^/?]+)$")
+
+
+def _normalize_id(uid):
+    return uid.replace("-", "")
+
+
+class ResponseCache(object):
+    """
+    Opt-in on-disk cache (SQLite) of the responses to GET calls, keyed on the
+    path, which includes the pagination cursor.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted beyond `max_entries`. The last_edited_time of the objects is
+    recorded as they come in, fetched on their own or as entries of the
+    listing of their parent: when an object shows up with a new one, the
+    cached listings of its children are dropped. So refetching a listing
+    revalidates the cached listings below it; the others expire with `ttl`.
+    """
+
+    TTL = 24 * 3600
+    MAX_ENTRIES = 100000
+
+    def __init__(
+        self, path: str, ttl: float = TTL, max_entries: int = MAX_ENTRIES
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                object_id TEXT,
+                parent_id TEXT,
+                last_edited_time TEXT,
+                body TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS versions (
+                object_id TEXT PRIMARY KEY,
+                last_edited_time TEXT NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_object ON responses (object_id)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_parent ON responses (parent_id)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)"
+        )
+        self._db.commit()
+
+    def _key(self, method, path):
+        return f"{method} {path}"
+
+    def get(self, method: str, path: str) -> Optional[Dict]:
+        key = self._key(method, path)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            body, stored_at = row
+            if stored_at + self.ttl < now:
+                # kept until replaced, to compare its last_edited_time
+                return None
+            self._db.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._db.commit()
+        return json.loads(body)
+
+    def set(self, method: str, path: str, body: Dict):
+        key = self._key(method, path)
+        now = time.time()
+        object_id = parent_id = None
+
+        match = OBJECT_PATH.match(path)
+        if match:
+            object_id = _normalize_id(match.group(1))
+        match = CHILDREN_PATH.match(path)
+        if match:
+            parent_id = _normalize_id(match.group(1))
+        last_edited_time = body.get("last_edited_time")
+
+        # the objects in the response, and their last_edited_time
+        versions = []
+        if object_id and last_edited_time:
+            versions.append((object_id, last_edited_time))
+        if parent_id:
+            versions.extend(
+                (_normalize_id(child["id"]), child["last_edited_time"])
+                for child in body.get("results", [])
+                if child.get("id") and child.get("last_edited_time")
+            )
+
+        with self._lock:
+            self._revalidate(versions)
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    object_id,
+                    parent_id,
+                    last_edited_time,
+                    json.dumps(body),
+                    now,
+                    now,
+                ),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _revalidate(self, versions):
+        for uid, last_edited_time in versions:
+            row = self._db.execute(
+                "SELECT last_edited_time FROM versions WHERE object_id = ?", (uid,)
+            ).fetchone()
+            if row and row[0] != last_edited_time:
+                self._db.execute("DELETE FROM responses WHERE parent_id = ?", (uid,))
+        self._db.executemany(
+            "INSERT OR REPLACE INTO versions VALUES (?, ?)", versions
+        )
+
+    def invalidate(self, path: str):
+        """Drop the cached responses about the object targeted by `path`."""
+        match = OBJECT_PATH.match(path) or CHILDREN_PATH.match(path)
+        if not match:
+            return
+        object_id = _normalize_id(match.group(1))
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM responses WHERE object_id = ? OR parent_id = ?",
+                (object_id, object_id),
+            )
+            self._db.commit()
+
+    def _evict(self):
+        self._inserts += 1
+        if self._inserts % 100:
+            return
+        (count,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed_at LIMIT ?
+                )
+                """,
+                (count - self.max_entries,),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,277 @@
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import sleep, time
+from typing import Dict, Optional
+
+
+class SharedFrontier(object):
+    """
+    A crawl frontier several processes, or hosts sharing a file system, pull
+    from (SQLite). A worker claims an item for `lease` seconds, renews the
+    lease while crawling it, then marks it done; the items claimed by a
+    worker that died are claimed again once their lease expired. The items
+    whose crawl failed are queued again, up to `max_attempts` times. An item
+    is only ever enqueued once.
+
+    Same policies as Frontier, but "priority".
+    """
+
+    FILENAME = "frontier.sqlite"
+    ORDERS = {
+        "lifo": "seq DESC",
+        "fifo": "seq",
+        "bfs": "depth, seq",
+        "dfs": "depth DESC, seq DESC",
+    }
+
+    def __init__(
+        self,
+        path: str,
+        policy: str = "bfs",
+        max_depth: Optional[int] = None,
+        root_quota: Optional[int] = None,
+        lease: float = 600,
+        poll_interval: float = 1,
+        max_attempts: int = 3,
+    ) -> None:
+        if policy not in self.ORDERS:
+            raise ValueError(
+                f"Unknown shared frontier policy {policy}, use one of {tuple(self.ORDERS)}"
+            )
+        self.path = path
+        self.order = self.ORDERS[policy]
+        self.max_depth = max_depth
+        self.root_quota = root_quota
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                root TEXT,
+                depth INTEGER,
+                item TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'queued',
+                worker TEXT,
+                claimed_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+            """
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(items)")}
+        # frontiers created before the failures were recorded
+        if "attempts" not in columns:
+            self._db.execute(
+                "ALTER TABLE items ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+            )
+            self._db.execute("ALTER TABLE items ADD COLUMN error TEXT")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS items_by_depth ON items (state, depth, seq)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS items_by_seq ON items (state, seq)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS items_by_root ON items (root)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def push(self, item: Dict) -> bool:
+        uid = item["id"]
+        item.setdefault("depth", 0)
+        item.setdefault("root", uid)
+
+        if self.max_depth is not None and item["depth"] > self.max_depth:
+            logging.debug(f"Skipping {uid}: deeper than {self.max_depth}")
+            return False
+
+        with self._transaction() as db:
+            if self.root_quota is not None:
+                (count,) = db.execute(
+                    "SELECT COUNT(*) FROM items WHERE root = ?", (item["root"],)
+                ).fetchone()
+                if count >= self.root_quota:
+                    logging.debug(f"Skipping {uid}: quota of {item['root']} reached")
+                    return False
+
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO items (id, root, depth, item) VALUES (?, ?, ?, ?)",
+                (uid, item["root"], item["depth"], json.dumps(item)),
+            )
+            return cursor.rowcount == 1
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """Claim the next item, if any is available now."""
+        now = time()
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT seq, item FROM items WHERE state = 'claimed' AND claimed_at < ? LIMIT 1",
+                (now - self.lease,),
+            ).fetchone()
+            if row is None:
+                row = db.execute(
+                    f"SELECT seq, item FROM items WHERE state = 'queued' ORDER BY {self.order} LIMIT 1"
+                ).fetchone()
+            if row is None:
+                return None
+
+            db.execute(
+                "UPDATE items SET state = 'claimed', worker = ?, claimed_at = ? WHERE seq = ?",
+                (worker, now, row[0]),
+            )
+        return json.loads(row[1])
+
+    def next_item(self, worker: str) -> Optional[Dict]:
+        """
+        Claim the next item, waiting for the other workers to enqueue some
+        while they are crawling. None once there is nothing left to crawl.
+        """
+        while True:
+            item = self.claim(worker)
+            if item is not None or not self.active():
+                return item
+            sleep(self.poll_interval)
+
+    def _set_state(self, uid, state):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE items SET state = ?, worker = NULL, claimed_at = NULL WHERE id = ?",
+                (state, uid),
+            )
+
+    def done(self, uid):
+        self._set_state(uid, "done")
+
+    def release(self, uid):
+        """Make a claimed item available to the other workers again."""
+        self._set_state(uid, "queued")
+
+    def renew(self, uid, worker: str) -> bool:
+        """Extend the lease of an item the worker is still crawling."""
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE items SET claimed_at = ? WHERE id = ? AND worker = ? AND state = 'claimed'",
+                (time(), uid, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, uid, error: str):
+        """
+        The crawl of a claimed item raised: queue it again, or mark it
+        failed once it was attempted `max_attempts` times.
+        """
+        with self._transaction() as db:
+            db.execute(
+                """
+                UPDATE items SET
+                    state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'queued' END,
+                    attempts = attempts + 1,
+                    error = ?,
+                    worker = NULL,
+                    claimed_at = NULL
+                WHERE id = ?
+                """,
+                (self.max_attempts, error, uid),
+            )
+
+    def failed(self) -> Dict[str, str]:
+        """The items given up on, and their last error."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, error FROM items WHERE state = 'failed'"
+            ).fetchall()
+        return dict(rows)
+
+    def release_all(self):
+        """
+        Release the items claimed by workers that are no longer running,
+        and give the failed items another round of attempts.
+        """
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE items SET state = 'queued', worker = NULL, claimed_at = NULL WHERE state = 'claimed'"
+            )
+            db.execute(
+                "UPDATE items SET state = 'queued', attempts = 0 WHERE state = 'failed'"
+            )
+
+    def clear(self):
+        with self._transaction() as db:
+            db.execute("DELETE FROM items")
+
+    def _count(self, *states):
+        placeholders = ", ".join("?" for _ in states)
+        with self._lock:
+            (count,) = self._db.execute(
+                f"SELECT COUNT(*) FROM items WHERE state IN ({placeholders})", states
+            ).fetchone()
+        return count
+
+    def active(self) -> int:
+        """The number of items queued or being crawled."""
+        return self._count("queued", "claimed")
+
+    def __len__(self):
+        return self._count("queued")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class WorkerFrontier(object):
+    """
+    The Frontier interface of a SharedFrontier, as seen by one worker: it is
+    "empty" only once no worker has anything left to crawl.
+    """
+
+    def __init__(self, shared: SharedFrontier, worker: str) -> None:
+        self.shared = shared
+        self.worker = worker
+        self._next = None
+
+    def push(self, item: Dict) -> bool:
+        return self.shared.push(item)
+
+    def __bool__(self):
+        if self._next is None:
+            self._next = self.shared.next_item(self.worker)
+        return self._next is not None
+
+    def popitem(self):
+        if not self:
+            raise KeyError("popitem(): frontier is empty")
+        item, self._next = self._next, None
+        return item["id"], item
+
+    def __setitem__(self, uid, item):
+        self.shared.release(uid)
+
+    def __contains__(self, uid):
+        return self._next is not None and self._next["id"] == uid
+
+    def __len__(self):
+        return len(self.shared)
+
+    def __iter__(self):
+        return iter(())
+
+    def values(self):
+        return []
@@ -0,0 +1,64 @@
+import copy
+import json
+import os
+import tempfile
+import unittest
+
+from cache import LRUCache
+from document_graph import DocumentGraph, LazyDocument
+
+
+class LazyDocumentTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.db = {}
+        self.page = self._dump(
+            "page",
+            {
+                "object": "page",
+                "children": [{"id": "database", "type": "child_database"}],
+            },
+        )
+        self._dump("database", {"object": "database", "items": ["item"]})
+        self._dump("item", {"object": "page", "properties": {"Name": "Line"}})
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def _dump(self, uid, data):
+        path = os.path.join(self.folder.name, f"{uid}.json")
+        with open(path, "w") as fd:
+            json.dump(data, fd)
+        self.db[uid] = path
+        return path
+
+    def _database(self):
+        data = DocumentGraph(self.db, cache=LRUCache()).load(self.page)
+        database = data["children"][0]["database"]
+        self.assertIsInstance(database, LazyDocument)
+        self.assertFalse(database._loaded)
+        return data, database
+
+    def test_json_dumps_unloaded(self):
+        data, _ = self._database()
+        dumped = json.loads(json.dumps(data))
+        database = dumped["children"][0]["database"]
+        self.assertEqual(database["object"], "database")
+        self.assertEqual(database["items"], [{"object": "page", "properties": {"Name": "Line"}}])
+
+    def test_deepcopy_unloaded(self):
+        _, database = self._database()
+        copied = copy.deepcopy(database)
+        self.assertIs(type(copied), dict)
+        self.assertEqual(copied["object"], "database")
+        self.assertEqual(copied["items"][0]["properties"], {"Name": "Line"})
+        self.assertEqual(copied, database)
+
+    def test_len_and_iteration_unloaded(self):
+        _, database = self._database()
+        self.assertEqual(len(database), 2)
+        self.assertEqual(sorted(database), ["items", "object"])
+
+
+if __name__ == "__main__":
+    unittest.main()